@@ -15,6 +15,20 @@ def get_bit(data, bit_index):
         return (cur_byte >> (7 - bit_index % 8)) & 0x1
     raise RuntimeError("Out of bound index %s" % bit_index)
 
+def get_bit_range(data, bit_index, bit_count):
+    """
+    Get bit_count bits starting at bit_index (0 is MSB of the first byte)
+    as bytes array, first bit in MSB, last byte padded with zero bits
+    """
+    start = bit_index // 8
+    end = (bit_index + bit_count + 7) // 8
+    if end > len(data):
+        raise RuntimeError("Out of bound index %s" % (bit_index + bit_count - 1))
+    value = int.from_bytes(data[start : end], byteorder='big')
+    value = (value >> (end * 8 - bit_index - bit_count)) & ((1 << bit_count) - 1)
+    num_bytes = (bit_count + 7) // 8
+    return (value << (num_bytes * 8 - bit_count)).to_bytes(num_bytes, byteorder='big')
+
 def get_reverse_bits(bytes_array):
     """
     Reverse all bits in arbitrary-length bytes array
@@ -38,3 +52,63 @@ def get_reverse_nibbles(bytes_array):
     Reverse nibbles in arbitrary-length bytes array
     """
     return bytes.fromhex(bytes_array.hex()[::-1])
+
+def get_reverse_pairs(bytes_array):
+    """
+    Reverse order of 2 bit pixels in arbitrary-length bytes array
+    """
+    num_bytes = len(bytes_array)
+    formatstring = "{0:0%db}" % (num_bytes * 8)
+    bit_str = formatstring.format(int.from_bytes(bytes_array, byteorder='big'))
+    pairs = [bit_str[i : i + 2] for i in range(0, len(bit_str), 2)]
+    pairs.reverse()
+    return int("".join(pairs), 2).to_bytes(num_bytes, byteorder='big')
+
+def unpack_pixels(row, bits_per_pixel, width):
+    """
+    Split row of packed pixels (first pixel in MSB) into
+    bytes with one pixel value each, width pixels long
+    """
+    if bits_per_pixel == 8:
+        return bytes(row[: width])
+    pixels_per_byte = 8 // bits_per_pixel
+    pixel_mask = (1 << bits_per_pixel) - 1
+    result = bytearray(len(row) * pixels_per_byte)
+    for i in range(pixels_per_byte):
+        shift = 8 - bits_per_pixel * (i + 1)
+        table = bytes((byte_val >> shift) & pixel_mask for byte_val in range(256))
+        result[i :: pixels_per_byte] = row.translate(table)
+    return bytes(result[: width])
+
+def pack_pixels(pixels, bits_per_pixel):
+    """
+    Pack bytes with one pixel value each into bits_per_pixel wide
+    fields, first pixel in MSB. Inverse of unpack_pixels().
+    """
+    if bits_per_pixel == 8:
+        return bytes(pixels)
+    pixels_per_byte = 8 // bits_per_pixel
+    pixels = bytes(pixels) + bytes(-len(pixels) % pixels_per_byte)
+    num_bytes = len(pixels) // pixels_per_byte
+    packed = 0
+    for i in range(pixels_per_byte):
+        shift = 8 - bits_per_pixel * (i + 1)
+        table = bytes((byte_val << shift) & 0xff for byte_val in range(256))
+        packed |= int.from_bytes(pixels[i :: pixels_per_byte].translate(table), byteorder='big')
+    return packed.to_bytes(num_bytes, byteorder='big')
+
+def get_remap_table(index_map, bits_per_pixel):
+    """
+    Build a 256 byte translation table for bytes.translate() that replaces
+    every bits_per_pixel wide pixel value v packed in a byte by index_map[v].
+    Pixel values not in index_map are kept.
+    """
+    pixel_mask = (1 << bits_per_pixel) - 1
+    table = bytearray(256)
+    for byte_val in range(256):
+        result = 0
+        for shift in range(0, 8, bits_per_pixel):
+            pixel = (byte_val >> shift) & pixel_mask
+            result |= (index_map.get(pixel, pixel) & pixel_mask) << shift
+        table[byte_val] = result
+    return bytes(table)
@@ -5,14 +5,19 @@
 Simple BMP file loader
 """
 
-import os
 import logging
+import os
+import struct
+import tempfile
+import unittest
 
 from collections import namedtuple
 
-logging.basicConfig(format='bmpfile -- %(message)s')
+import bits
+
+logging.basicConfig(format='%(name)s -- %(message)s')
 LOGGER = logging.getLogger('bmpfile')
-LOGGER.setLevel(logging.DEBUG)
+LOGGER.setLevel(logging.WARNING)
 
 
 BMPData = namedtuple("BMPData",
@@ -24,80 +29,471 @@ BMPData = namedtuple("BMPData",
                       "row_size",
                       "row_data",])
 
+BMPHeader = namedtuple("BMPHeader",
+                       ["image_width",
+                        "image_height",
+                        "bits_per_pixel",
+                        "palette_size",
+                        "palette",
+                        "row_size",
+                        "top_down",
+                        "compression_method",
+                        "imgdata_offset",
+                        "image_size",])
+
+# BITMAPFILEHEADER followed by the BITMAPINFOHEADER part common to all later versions
+HEADER_FORMAT = "<2sIHHIIiiHHIIiiII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# BITMAPINFOHEADER, V2, V3, V4 (MS Paint) and V5
+DIB_HEADER_SIZES = (40, 52, 56, 108, 124)
+
+BI_RGB = 0
+BI_RLE8 = 1
+BI_RLE4 = 2
+RLE_BITS_PER_PIXEL = {BI_RLE8: 8, BI_RLE4: 4}
+
+# Enough to hold the largest DIB header and a full 8 bit palette
+MAX_HEADER_SIZE = 14 + max(DIB_HEADER_SIZES) + 256 * 4
+
+RESAMPLE_FILTERS = ("nearest", "box")
+
+def decode_rle(data, compression_method, image_width, image_height, row_size):
+    """
+    Decode BI_RLE8 or BI_RLE4 compressed pixel data into a bottom-up
+    packed buffer of image_height rows of row_size bytes.
+    Runs are cut at the end of their row, deltas outside the image and
+    truncated escapes raise.
+    """
+    buffer = bytearray(row_size * image_height)
+    is_rle4 = compression_method == BI_RLE4
+    pos = 0
+    x_pos = 0
+    y_pos = 0
+
+    def put_nibbles(nibble_bytes, count):
+        # Write count nibbles, high nibble of each byte first, at x_pos in row y_pos
+        row_start = y_pos * row_size
+        if x_pos % 2 == 0:
+            start = row_start + x_pos // 2
+            buffer[start : start + count // 2] = nibble_bytes[: count // 2]
+            if count % 2:
+                index = start + count // 2
+                buffer[index] = (buffer[index] & 0x0f) | (nibble_bytes[count // 2] & 0xf0)
+        else:
+            for i in range(count):
+                nibble = (nibble_bytes[i // 2] >> (0 if i % 2 else 4)) & 0x0f
+                index = row_start + (x_pos + i) // 2
+                if (x_pos + i) % 2:
+                    buffer[index] = (buffer[index] & 0xf0) | nibble
+                else:
+                    buffer[index] = (buffer[index] & 0x0f) | (nibble << 4)
+
+    while pos + 1 < len(data) and y_pos < image_height:
+        count = data[pos]
+        value = data[pos + 1]
+        pos += 2
+        if count > 0:
+            # Encoded mode: count pixels of value
+            count = min(count, image_width - x_pos)
+            if is_rle4:
+                put_nibbles(bytes((value,)) * ((count + 1) // 2), count)
+            else:
+                start = y_pos * row_size + x_pos
+                buffer[start : start + count] = bytes((value,)) * count
+            x_pos += count
+        elif value == 0:
+            x_pos = 0
+            y_pos += 1
+        elif value == 1:
+            break
+        elif value == 2:
+            if pos + 2 > len(data):
+                raise RuntimeError("RLE data ends inside delta escape")
+            x_pos += data[pos]
+            y_pos += data[pos + 1]
+            pos += 2
+            if x_pos > image_width or y_pos > image_height:
+                raise RuntimeError("RLE delta moves outside of %dx%d image"
+                                   % (image_width, image_height))
+        else:
+            # Absolute mode: value literal pixels, padded to 16 bit boundary
+            num_bytes = (value + 1) // 2 if is_rle4 else value
+            if pos + num_bytes > len(data):
+                raise RuntimeError("RLE data ends inside absolute run")
+            literal = data[pos : pos + num_bytes]
+            pos += num_bytes + num_bytes % 2
+            count = min(value, image_width - x_pos)
+            if is_rle4:
+                put_nibbles(literal, count)
+            else:
+                start = y_pos * row_size + x_pos
+                buffer[start : start + count] = literal[: count]
+            x_pos += count
+    return buffer
+
+def parse_header(data, filepath, file_size):
+    """
+    Parse and check file header, DIB header and palette at the start of data.
+    Header diagnostics are logged at INFO level.
+    """
+    if len(data) < HEADER_SIZE:
+        raise RuntimeError("File too short for BMP header")
+    (header_text, filesize, _reserved1, _reserved2, imgdata_offset,
+     dib_header_size, image_width, image_height, color_planes, bits_per_pixel,
+     compression_method, image_size, _x_resolution, _y_resolution,
+     palette_size, _important_colors) = struct.unpack_from(HEADER_FORMAT, data)
+
+    LOGGER.info("Read file %s: header %s, file size %s, image data offset %s, "
+                "DIB header size %s, image %sx%s, color planes %s, bits per pixel %s, "
+                "compression method %s, raw image size %s, palette size %s",
+                filepath, header_text, filesize, imgdata_offset, dib_header_size,
+                image_width, image_height, color_planes, bits_per_pixel,
+                compression_method, image_size, palette_size)
+
+    if header_text != b"BM":
+        raise RuntimeError("File has incorrect header, expected 'BM'")
+    if file_size != filesize:
+        raise RuntimeError("Header reports incorrect file size")
+    if dib_header_size not in DIB_HEADER_SIZES:
+        raise RuntimeError("DIB header size %d not supported, expected one of %s"
+                           % (dib_header_size, DIB_HEADER_SIZES))
+    if color_planes != 1:
+        raise RuntimeError("1 color plane expected")
+
+    top_down = image_height < 0
+    image_height = abs(image_height)
+
+    if compression_method in RLE_BITS_PER_PIXEL:
+        if bits_per_pixel != RLE_BITS_PER_PIXEL[compression_method]:
+            raise RuntimeError("Compression method %d requires %d bits per pixel"
+                               % (compression_method, RLE_BITS_PER_PIXEL[compression_method]))
+        if top_down:
+            raise RuntimeError("RLE compressed images can not be top-down")
+    elif compression_method != BI_RGB:
+        raise RuntimeError("Only compression methods 0 (none), 1 (RLE8) and 2 (RLE4) "
+                           "are supported")
+
+    if palette_size == 0:
+        if bits_per_pixel > 8:
+            raise RuntimeError("Palette size 0 detected: only palette images are supported")
+        palette_size = 1 << bits_per_pixel
+
+    palette_start = 14 + dib_header_size
+    palette_bytes = data[palette_start : palette_start + palette_size * 4]
+    palette = list(zip(palette_bytes[2::4], palette_bytes[1::4], palette_bytes[0::4]))
+
+    row_size = int(int((bits_per_pixel * image_width + 31) / 32) * 4)
+
+    return BMPHeader(image_width,
+                     image_height,
+                     bits_per_pixel,
+                     palette_size,
+                     palette,
+                     row_size,
+                     top_down,
+                     compression_method,
+                     imgdata_offset,
+                     image_size,)
+
 def load_bmp(filepath):
     """
     See https://en.wikipedia.org/wiki/BMP_file_format
+    Rows are always returned bottom-up, top-down and RLE compressed
+    images are converted. Header diagnostics are logged at INFO level.
     """
     with open(filepath, "rb") as binary_file:
         data = binary_file.read()
-        LOGGER.info("Read file %s", filepath)
 
-    header_text = data[0:2].decode('utf-8')
-    LOGGER.info("BMP header %s", header_text)
-    if header_text != "BM":
-        raise RuntimeError("File has incorrect header, expected 'BM'")
+    header = parse_header(data, filepath, len(data))
+    row_size = header.row_size
+    image_height = header.image_height
+    imgdata_offset = header.imgdata_offset
 
-    filesize = int.from_bytes(data[2:6], byteorder='little')
-    LOGGER.info("File size in header %s", filesize)
-    if os.path.getsize(filepath) != filesize:
-        raise RuntimeError("Header reports incorrect file size")
+    if header.compression_method == BI_RGB:
+        pixel_data = data[imgdata_offset : imgdata_offset + row_size * image_height]
+    else:
+        compressed_size = header.image_size if header.image_size else len(data) - imgdata_offset
+        pixel_data = decode_rle(data[imgdata_offset : imgdata_offset + compressed_size],
+                                header.compression_method, header.image_width,
+                                image_height, row_size)
+    if len(pixel_data) < row_size * image_height:
+        raise RuntimeError("File too short for image data")
 
-    imgdata_offset = int.from_bytes(data[10:14], byteorder='little')
-    LOGGER.info("Image data offset %s", imgdata_offset)
+    row_data = [bytes(pixel_data[i * row_size : (i + 1) * row_size])
+                for i in range(image_height)]
+    if header.top_down:
+        row_data.reverse()
+
+    return BMPData(header.image_width,
+                   image_height,
+                   header.bits_per_pixel,
+                   header.palette_size,
+                   header.palette,
+                   row_size,
+                   row_data,)
 
-    dib_header_size = int.from_bytes(data[14:18], byteorder='little')
-    LOGGER.info("DIB header size %s", dib_header_size)
-    if dib_header_size != 40:
-        raise RuntimeError("DIB header size 40 (BITMAPINFOHEADER) expected")
+def get_nearest_color_index(palette, color_sums, count):
+    """
+    Index of the palette color closest to the average of count colors
+    whose channel sums are color_sums
+    """
+    return min(range(len(palette)),
+               key=lambda i: sum((channel * count - channel_sum) ** 2
+                                 for channel, channel_sum in zip(palette[i], color_sums)))
 
-    image_width = int.from_bytes(data[18:22], byteorder='little')
-    LOGGER.info("Image width %s", image_width)
+def get_channel_tables(palette):
+    """
+    bytes.translate() tables from palette index to red, green and blue
+    """
+    return [bytes(color[channel] for color in palette[: 256]).ljust(256, b"\0")
+            for channel in range(3)]
 
-    image_height = int.from_bytes(data[22:26], byteorder='little')
-    LOGGER.info("Image height %s", image_height)
+def get_box_filtered_pixels(rows, palette, scale, cache, channel_tables):
+    """
+    Average every scale x scale box of rows (one pixel value per byte,
+    scale rows) and map the average color back to the palette.
+    Channel sums are added in 16 bit lanes of one big int per channel,
+    cache maps the lane bytes of a box to its palette index.
+    """
+    width = len(rows[0]) // scale * scale
+    sum_bytes = []
+    for table in channel_tables:
+        lanes = 0
+        for row in rows:
+            buffer = bytearray(2 * width)
+            buffer[::2] = row[: width].translate(table)
+            lanes += int.from_bytes(buffer, byteorder='little')
+        lanes = sum(lanes >> (16 * k) for k in range(scale))
+        lane_bytes = lanes.to_bytes(2 * width, byteorder='little')
+        sum_bytes.extend((lane_bytes[0 :: 2 * scale], lane_bytes[1 :: 2 * scale]))
 
-    color_planes = int.from_bytes(data[26:28], byteorder='little')
-    LOGGER.info("Color planes %s", color_planes)
-    if color_planes != 1:
-        raise RuntimeError("1 color plane expected")
+    keys = list(zip(*sum_bytes))
+    for key in set(keys).difference(cache):
+        color_sums = [low + (high << 8) for low, high in zip(key[0::2], key[1::2])]
+        cache[key] = get_nearest_color_index(palette, color_sums, scale * scale)
+    return bytes(map(cache.__getitem__, keys))
 
-    bits_per_pixel = int.from_bytes(data[28:30], byteorder='little')
-    LOGGER.info("Bits per pixel %s", bits_per_pixel)
+def load_bmp_region(filepath, crop=None, scale=1, resample="nearest"):
+    """
+    Load only the crop rectangle (x, y, width, height) of an image, y counted
+    from the top row, and downscale it by the integer factor scale with
+    nearest neighbour or box filter. Uncompressed files are read row group
+    by row group, so time and memory grow with the output size, not the
+    image size. RLE compressed files are decoded in full first.
+    Returns BMPData like load_bmp() with the same palette and bits per pixel.
+    """
+    if resample not in RESAMPLE_FILTERS:
+        raise RuntimeError("Unknown resample filter %s, expected one of %s"
+                           % (resample, RESAMPLE_FILTERS))
+    if scale < 1:
+        raise RuntimeError("Scale factor must be at least 1")
 
-    compression_method = int.from_bytes(data[30:34], byteorder='little')
-    LOGGER.info("Compression method %s", compression_method)
-    if compression_method != 0:
-        raise RuntimeError("Only compression method 0 is supported")
+    with open(filepath, "rb") as binary_file:
+        file_size = os.fstat(binary_file.fileno()).st_size
+        header = parse_header(binary_file.read(MAX_HEADER_SIZE), filepath, file_size)
+        image_height = header.image_height
+        row_size = header.row_size
+        bits_per_pixel = header.bits_per_pixel
 
-    image_size = int.from_bytes(data[34:38], byteorder='little')
-    LOGGER.info("Raw image size %s", image_size)
+        if crop is None:
+            crop = (0, 0, header.image_width, image_height)
+        x_pos, y_pos, width, height = crop
+        if (x_pos < 0 or y_pos < 0 or width < scale or height < scale
+                or x_pos + width > header.image_width or y_pos + height > image_height):
+            raise RuntimeError("Crop rectangle %s outside of %dx%d image or smaller than "
+                               "scale %d" % (crop, header.image_width, image_height, scale))
 
-    palette_size = int.from_bytes(data[46:50], byteorder='little')
-    LOGGER.info("Palette size %s", palette_size)
-    if palette_size == 0:
-        raise RuntimeError("Palette size 0 detected: possibly due to MS Paint saving in "
-                           "modified format, please try a different program to generate BMP")
+        if header.compression_method == BI_RGB:
+            if file_size < header.imgdata_offset + row_size * image_height:
+                raise RuntimeError("File too short for image data")
+            full_rows = None
+        else:
+            full_rows = load_bmp(filepath).row_data
 
-    palette = [None] * palette_size
-    for i in range(palette_size):
-        palette_index = 14 + dib_header_size + i * 4
-        blue = data[palette_index]
-        green = data[palette_index + 1]
-        red = data[palette_index + 2]
-        palette[i] = (red, green, blue)
+        def read_rows(top_row, count):
+            # Rows top_row to top_row + count counted from the top, topmost first
+            if full_rows is not None:
+                return [full_rows[image_height - 1 - i] for i in range(top_row, top_row + count)]
+            first_row = top_row if header.top_down else image_height - top_row - count
+            binary_file.seek(header.imgdata_offset + first_row * row_size)
+            data = binary_file.read(count * row_size)
+            rows = [data[i * row_size : (i + 1) * row_size] for i in range(count)]
+            if not header.top_down:
+                rows.reverse()
+            return rows
 
-    row_size = int(int((bits_per_pixel * image_width + 31) / 32) * 4)
-    LOGGER.info("Row size %s bytes", row_size)
+        out_width = width // scale
+        out_row_size = int(int((bits_per_pixel * out_width + 31) / 32) * 4)
+        group_rows = scale if resample == "box" else 1
+        cache = {}
+        channel_tables = get_channel_tables(header.palette)
+        row_data = []
+        for out_y in range(height // scale):
+            rows = read_rows(y_pos + out_y * scale, group_rows)
+            if bits_per_pixel == 8:
+                rows = [row[x_pos : x_pos + width] for row in rows]
+            else:
+                rows = [bits.get_bit_range(row, x_pos * bits_per_pixel, width * bits_per_pixel)
+                        for row in rows]
+            if scale > 1:
+                rows = [bits.unpack_pixels(row, bits_per_pixel, width) for row in rows]
+                if resample == "box":
+                    pixels = get_box_filtered_pixels(rows, header.palette, scale,
+                                                     cache, channel_tables)
+                else:
+                    pixels = rows[0][: out_width * scale : scale]
+                rows = [bits.pack_pixels(pixels, bits_per_pixel)]
+            row_data.append(rows[0] + bytes(out_row_size - len(rows[0])))
+    row_data.reverse()
 
-    row_data = [None] * image_height
-    for i in range(image_height):
-        row_index = imgdata_offset + i * row_size
-        row_data[i] = data[row_index : row_index + row_size]
+    LOGGER.info("Loaded %dx%d region at %d,%d scaled by 1/%d to %dx%d",
+                width, height, x_pos, y_pos, scale, out_width, len(row_data))
 
-    return BMPData(image_width,
-                   image_height,
+    return BMPData(out_width,
+                   len(row_data),
                    bits_per_pixel,
-                   palette_size,
-                   palette,
-                   row_size,
+                   header.palette_size,
+                   header.palette,
+                   out_row_size,
                    row_data,)
+
+def save_bmp(filepath, bmp_data):
+    """
+    Write bmp_data as uncompressed BITMAPINFOHEADER file,
+    row_data must already be padded to row_size
+    """
+    dib_header_size = 40
+    imgdata_offset = 14 + dib_header_size + bmp_data.palette_size * 4
+    image_size = bmp_data.row_size * bmp_data.image_height
+    filesize = imgdata_offset + image_size
+
+    header = (b"BM"
+              + filesize.to_bytes(4, byteorder='little')
+              + bytes(4)
+              + imgdata_offset.to_bytes(4, byteorder='little')
+              + dib_header_size.to_bytes(4, byteorder='little')
+              + bmp_data.image_width.to_bytes(4, byteorder='little')
+              + bmp_data.image_height.to_bytes(4, byteorder='little')
+              + (1).to_bytes(2, byteorder='little')
+              + bmp_data.bits_per_pixel.to_bytes(2, byteorder='little')
+              + bytes(4)
+              + image_size.to_bytes(4, byteorder='little')
+              + bytes(8)
+              + bmp_data.palette_size.to_bytes(4, byteorder='little')
+              + bytes(4))
+    palette = bytes().join(bytes((blue, green, red, 0))
+                           for red, green, blue in bmp_data.palette)
+
+    with open(filepath, "wb") as binary_file:
+        binary_file.write(header + palette + bytes().join(bmp_data.row_data))
+    LOGGER.info("Wrote file %s", filepath)
+
+class TestBMPFile(unittest.TestCase):
+    """
+    Test class for BMP loader
+    """
+    @staticmethod
+    def write_bmp(filepath, dib_header_size, height, bits_per_pixel,
+                  compression_method, pixel_data):
+        """
+        Write minimal BMP with 2 color palette and given header variant
+        """
+        palette = bytes((0, 0, 0, 0, 255, 255, 255, 0))
+        imgdata_offset = 14 + dib_header_size + len(palette)
+        header = struct.pack(HEADER_FORMAT, b"BM", imgdata_offset + len(pixel_data), 0, 0,
+                             imgdata_offset, dib_header_size, 8, height, 1,
+                             bits_per_pixel, compression_method, len(pixel_data),
+                             0, 0, 2, 0)
+        with open(filepath, "wb") as binary_file:
+            binary_file.write(header + bytes(dib_header_size - 40) + palette + pixel_data)
+
+    def test_headers(self):
+        """
+        Existing BITMAPINFOHEADER files and top-down V5 header
+        """
+        bmp_data = load_bmp("test_32x32_4bpp.bmp")
+        self.assertEqual((bmp_data.image_width, bmp_data.image_height,
+                          bmp_data.bits_per_pixel, bmp_data.palette_size,
+                          bmp_data.row_size), (32, 32, 4, 16, 16))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "v5.bmp")
+            self.write_bmp(filepath, 124, -2, 8, BI_RGB, bytes(range(16)))
+            bmp_data = load_bmp(filepath)
+        self.assertEqual(bmp_data.image_height, 2)
+        self.assertEqual(bmp_data.palette, [(0, 0, 0), (255, 255, 255)])
+        self.assertEqual(bmp_data.row_data, [bytes(range(8, 16)), bytes(range(8))])
+
+    def test_rle(self):
+        """
+        RLE8 and RLE4 decoding with all escape codes
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "rle8.bmp")
+            self.write_bmp(filepath, 40, 3, 8, BI_RLE8,
+                           bytes((3, 1, 0, 3, 5, 6, 7, 0, 0, 0,
+                                  0, 2, 2, 1, 2, 9, 0, 0, 0, 1)))
+            bmp_data = load_bmp(filepath)
+            self.assertEqual(bmp_data.row_data, [bytes((1, 1, 1, 5, 6, 7, 0, 0)),
+                                                 bytes(8),
+                                                 bytes((0, 0, 9, 9, 0, 0, 0, 0))])
+
+            filepath = os.path.join(temp_dir, "rle4.bmp")
+            self.write_bmp(filepath, 40, 2, 4, BI_RLE4,
+                           bytes((3, 0x12, 0, 3, 0x34, 0x50, 2, 0xff, 0, 0,
+                                  0, 2, 1, 0, 5, 0xab, 0, 1)))
+            bmp_data = load_bmp(filepath)
+            self.assertEqual(bmp_data.row_data, [bytes((0x12, 0x13, 0x45, 0xff)),
+                                                 bytes((0x0a, 0xba, 0xba, 0x00))])
+
+        # Delta to the end of the row, runs there are cut to nothing
+        buffer = decode_rle(bytes((0, 2, 8, 0, 0, 3, 1, 2, 3, 0, 2, 7, 0, 0, 4, 5, 0, 1)),
+                            BI_RLE8, 8, 2, 8)
+        self.assertEqual(buffer, bytes(8) + bytes((5, 5, 5, 5, 0, 0, 0, 0)))
+        # Delta past the end of the row or image
+        for delta in ((9, 0), (0, 3)):
+            with self.assertRaises(RuntimeError):
+                decode_rle(bytes((0, 2) + delta + (0, 3, 1, 2, 3, 0, 0, 1)), BI_RLE8, 8, 2, 8)
+        # Stream ends inside an absolute run or delta escape
+        for data, compression_method, row_size in ((bytes((0, 5, 0x12)), BI_RLE4, 4),
+                                                   (bytes((0, 5, 1, 2, 3)), BI_RLE8, 8),
+                                                   (bytes((0, 2, 1)), BI_RLE8, 8)):
+            with self.assertRaises(RuntimeError):
+                decode_rle(data, compression_method, 8, 2, row_size)
+
+    def test_region(self):
+        """
+        Cropped and downscaled loading against the full image
+        """
+        for bits_per_pixel in (1, 4, 8):
+            filepath = "test_32x32_%dbpp.bmp" % bits_per_pixel
+            bmp_data = load_bmp(filepath)
+            self.assertEqual(load_bmp_region(filepath), bmp_data)
+
+            # Top row first, like the crop coordinates
+            full = [bits.unpack_pixels(row, bits_per_pixel, 32)
+                    for row in reversed(bmp_data.row_data)]
+            region = load_bmp_region(filepath, (3, 5, 17, 8))
+            self.assertEqual((region.image_width, region.image_height), (17, 8))
+            self.assertEqual([bits.unpack_pixels(row, bits_per_pixel, 17)
+                              for row in reversed(region.row_data)],
+                             [row[3 : 20] for row in full[5 : 13]])
+
+            region = load_bmp_region(filepath, (1, 2, 30, 30), 4)
+            self.assertEqual([bits.unpack_pixels(row, bits_per_pixel, 7)
+                              for row in reversed(region.row_data)],
+                             [row[1 : 29 : 4] for row in full[2 : 30 : 4]])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "box.bmp")
+            self.write_bmp(filepath, 124, -2, 8, BI_RGB,
+                           bytes((0, 0, 1, 1, 0, 1, 1, 1, 0, 0, 1, 1, 0, 0, 1, 1)))
+            region = load_bmp_region(filepath, scale=2, resample="box")
+            self.assertEqual(region.row_data, [bytes((0, 1, 0, 1))])
+
+            filepath = os.path.join(temp_dir, "rle8.bmp")
+            self.write_bmp(filepath, 40, 2, 8, BI_RLE8,
+                           bytes((3, 1, 0, 3, 5, 6, 7, 0, 0, 0, 8, 9, 0, 1)))
+            region = load_bmp_region(filepath, (2, 1, 3, 1))
+            self.assertEqual(region.row_data, [bytes((1, 5, 6, 0))])
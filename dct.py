@@ -100,6 +100,126 @@ def get_2d_idct(input_matrix):
 
     return result
 
+# Integer fixed-point 8x8 DCT after libjpeg's jfdctint.c (islow), which uses the
+# Loeffler-Ligtenberg-Moschytz factorization with 12 multiplications per 1D DCT.
+# Outputs are scaled up by a factor of 8 compared to get_2d_dct().
+ISLOW_CONST_BITS = 13
+ISLOW_PASS1_BITS = 2
+FIX_0_298631336 = 2446
+FIX_0_390180644 = 3196
+FIX_0_541196100 = 4433
+FIX_0_765366865 = 6270
+FIX_0_899976223 = 7373
+FIX_1_175875602 = 9633
+FIX_1_501321110 = 12299
+FIX_1_847759065 = 15137
+FIX_1_961570560 = 16069
+FIX_2_053119869 = 16819
+FIX_2_562915447 = 20995
+FIX_3_072711026 = 25172
+
+BACKENDS = ("float", "islow")
+
+def get_1d_dct_islow(data, first_pass):
+    """
+    One row or column of the islow DCT on 8 ints.
+    The first pass keeps PASS1_BITS extra bits of precision, the second removes them.
+    """
+    if first_pass:
+        even_shift = -ISLOW_PASS1_BITS
+        odd_shift = ISLOW_CONST_BITS - ISLOW_PASS1_BITS
+    else:
+        even_shift = ISLOW_PASS1_BITS
+        odd_shift = ISLOW_CONST_BITS + ISLOW_PASS1_BITS
+
+    def descale(value, shift):
+        if shift <= 0:
+            return value << -shift
+        return (value + (1 << (shift - 1))) >> shift
+
+    tmp0 = data[0] + data[7]
+    tmp7 = data[0] - data[7]
+    tmp1 = data[1] + data[6]
+    tmp6 = data[1] - data[6]
+    tmp2 = data[2] + data[5]
+    tmp5 = data[2] - data[5]
+    tmp3 = data[3] + data[4]
+    tmp4 = data[3] - data[4]
+
+    # Even part
+    tmp10 = tmp0 + tmp3
+    tmp13 = tmp0 - tmp3
+    tmp11 = tmp1 + tmp2
+    tmp12 = tmp1 - tmp2
+
+    result = [0] * 8
+    result[0] = descale(tmp10 + tmp11, even_shift)
+    result[4] = descale(tmp10 - tmp11, even_shift)
+    z1 = (tmp12 + tmp13) * FIX_0_541196100
+    result[2] = descale(z1 + tmp13 * FIX_0_765366865, odd_shift)
+    result[6] = descale(z1 - tmp12 * FIX_1_847759065, odd_shift)
+
+    # Odd part
+    z1 = tmp4 + tmp7
+    z2 = tmp5 + tmp6
+    z3 = tmp4 + tmp6
+    z4 = tmp5 + tmp7
+    z5 = (z3 + z4) * FIX_1_175875602
+
+    tmp4 *= FIX_0_298631336
+    tmp5 *= FIX_2_053119869
+    tmp6 *= FIX_3_072711026
+    tmp7 *= FIX_1_501321110
+    z1 *= -FIX_0_899976223
+    z2 *= -FIX_2_562915447
+    z3 = z3 * -FIX_1_961570560 + z5
+    z4 = z4 * -FIX_0_390180644 + z5
+
+    result[7] = descale(tmp4 + z1 + z3, odd_shift)
+    result[5] = descale(tmp5 + z2 + z4, odd_shift)
+    result[3] = descale(tmp6 + z2 + z3, odd_shift)
+    result[1] = descale(tmp7 + z1 + z4, odd_shift)
+    return result
+
+def get_2d_dct_islow(input_matrix):
+    """
+    Apply integer DCT on 8x8 matrix (nested list) of ints,
+    return 8x8 matrix of ints scaled up by 8
+    """
+    if len(input_matrix) != 8:
+        raise RuntimeError("islow DCT requires 8x8 blocks")
+    rows = [get_1d_dct_islow(row, True) for row in input_matrix]
+    columns = [get_1d_dct_islow(column, False) for column in zip(*rows)]
+    return [list(row) for row in zip(*columns)]
+
+def get_quantized_2d_dct(input_matrix, quant_mtx, backend="float", input_scale=1):
+    """
+    Apply DCT on square matrix input_matrix and quantize the top-left
+    coefficients covered by quant_mtx, rounding to nearest.
+    Input values are samples multiplied by input_scale, they must be
+    ints for the "islow" backend which folds its output scaling into
+    the quantization divisors.
+    """
+    quant_width = len(quant_mtx)
+    if backend == "float":
+        dct_block = get_2d_dct(input_matrix)
+        return [[int(round(dct_block[y][x] / (quant_mtx[y][x] * input_scale)))
+                 for x in range(quant_width)]
+                for y in range(quant_width)]
+    if backend == "islow":
+        dct_block = get_2d_dct_islow(input_matrix)
+        result = []
+        for y in range(quant_width):
+            quantized_row = []
+            for x in range(quant_width):
+                divisor = quant_mtx[y][x] * input_scale * 8
+                value = dct_block[y][x]
+                quantized = (abs(value) + divisor // 2) // divisor
+                quantized_row.append(quantized if value >= 0 else -quantized)
+            result.append(quantized_row)
+        return result
+    raise RuntimeError("Unknown DCT backend %s, expected one of %s" % (backend, BACKENDS))
+
 class TestDCT(unittest.TestCase):
     """
     Test class for DCT functions
@@ -133,5 +253,28 @@ class TestDCT(unittest.TestCase):
                     for j in range(list_len):
                         self.assertAlmostEqual(x[i][j], idct_x[i][j])
 
+    def test_islow(self):
+        """
+        Integer DCT compared to float DCT
+        """
+        random.seed()
+        quant_mtx = [[16, 11, 10, 16,],
+                     [12, 12, 14, 19,],
+                     [14, 13, 16, 24,],
+                     [14, 17, 22, 29,],]
+        for _iteration in range(100):
+            x = [[random.randint(-384, 381) for _j in range(8)] for _i in range(8)]
+            float_dct = get_2d_dct(x)
+            islow_dct = get_2d_dct_islow(x)
+            for i in range(8):
+                for j in range(8):
+                    self.assertLessEqual(abs(islow_dct[i][j] / 8.0 - float_dct[i][j]), 0.5)
+
+            float_quantized = get_quantized_2d_dct(x, quant_mtx, "float", 3)
+            islow_quantized = get_quantized_2d_dct(x, quant_mtx, "islow", 3)
+            for i in range(4):
+                for j in range(4):
+                    self.assertLessEqual(abs(islow_quantized[i][j] - float_quantized[i][j]), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+GLSL output optimizer: shortest literals, identifier and whitespace
+minification, packing of constant int arrays into ivec4 arrays
+"""
+
+import re
+import itertools
+import string
+import unittest
+
+TOKEN_RE = re.compile(r"""
+    //[^\n]*
+  | /\*.*?\*/
+  | \s+
+  | 0[xX][0-9a-fA-F]+[uU]?
+  | (?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?[uUfF]?
+  | [A-Za-z_]\w*
+  | <<=|>>=|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||\^\^|[-+*/%&|^]=
+  | .
+""", re.VERBOSE | re.DOTALL)
+
+TYPES = {"void", "bool", "int", "uint", "float",
+         "vec2", "vec3", "vec4", "ivec2", "ivec3", "ivec4",
+         "uvec2", "uvec3", "uvec4", "bvec2", "bvec3", "bvec4",
+         "mat2", "mat3", "mat4",}
+
+# Keywords and builtins short enough to clash with generated names
+RESERVED = {"do", "if", "in", "for", "out", "abs", "all", "any", "cos", "dot", "exp",
+            "log", "max", "min", "mix", "mod", "not", "pow", "sin", "tan", "lowp", "highp",
+            "inout", "break", "const", "while", "return", "continue", "discard",
+            "struct", "uniform", "true", "false", "sign", "step", "exp2", "log2",
+            "sqrt", "acos", "asin", "atan", "ceil", "fract", "floor", "round", "trunc",} | TYPES
+
+KEEP = {"mainImage"}    # Entry point called by Shadertoy
+
+INT_MAX = 0x7fffffff
+
+
+def tokenize(source):
+    """
+    Split GLSL source into tokens, whitespace and comments are kept as tokens
+    """
+    return TOKEN_RE.findall(source)
+
+def is_space(token):
+    """
+    Whitespace and comment tokens
+    """
+    return token.isspace() or token.startswith("//") or token.startswith("/*")
+
+def is_ident(token):
+    """
+    Identifier or keyword token
+    """
+    return token[0] == "_" or token[0].isalpha()
+
+def is_int_literal(token):
+    """
+    Signed integer literal without suffix
+    """
+    return (re.fullmatch(r"0[xX][0-9a-fA-F]+|\d+", token) is not None
+            and not (len(token) > 1 and token[0] == "0" and token[1].isdigit()))
+
+def next_token(tokens, index):
+    """
+    Index of next non-whitespace token after index, len(tokens) if none
+    """
+    index += 1
+    while index < len(tokens) and is_space(tokens[index]):
+        index += 1
+    return index
+
+def prev_token(tokens, index):
+    """
+    Previous non-whitespace token before index, empty string if none
+    """
+    index -= 1
+    while index >= 0 and is_space(tokens[index]):
+        index -= 1
+    return tokens[index] if index >= 0 else ""
+
+def get_shortest_int(token, prev):
+    """
+    Shortest spelling of an int literal. Values above INT_MAX are only
+    valid in hex or, directly after ( , or =, as negative decimal.
+    """
+    value = int(token, 0)
+    if value >= 1 << 32:
+        return token
+    candidates = ["0x{0:x}".format(value)]
+    if value <= INT_MAX:
+        candidates.append(str(value))
+    elif prev in ("(", ",", "=") and value != 1 << 31:
+        candidates.append(str(value - (1 << 32)))
+    return min(candidates, key=len)
+
+def get_shortest_float(token):
+    """
+    Shortest spelling of a float literal with decimal point and no exponent
+    """
+    if re.fullmatch(r"\d*\.\d*", token) is None:
+        return token
+    int_part, frac_part = token.split(".")
+    int_part = int_part.lstrip("0")
+    frac_part = frac_part.rstrip("0")
+    if not int_part and not frac_part:
+        return "0."
+    return int_part + "." + frac_part
+
+def find_closing(tokens, index):
+    """
+    Index of bracket closing the one at index
+    """
+    pairs = {"(": ")", "[": "]", "{": "}"}
+    opening = tokens[index]
+    depth = 0
+    for i in range(index, len(tokens)):
+        if tokens[i] == opening:
+            depth += 1
+        elif tokens[i] == pairs[opening]:
+            depth -= 1
+            if depth == 0:
+                return i
+    raise RuntimeError("Unbalanced %s in GLSL source" % opening)
+
+def pack_int_arrays(tokens):
+    """
+    Replace every "const int[] name = int[] (...);" by an ivec4 array of a
+    quarter of the length plus accessor function name_at(), and rewrite
+    all reads name[i] and name.length() to match.
+    """
+    decl_pattern = ["const", "int", "[", "]", None, "=", "int", "[", "]", "("]
+    accessors = {}
+    result = []
+    index = 0
+    while index < len(tokens):
+        decl_indices = []
+        pos = index
+        for expected in decl_pattern:
+            if pos >= len(tokens) or (expected is not None and tokens[pos] != expected):
+                break
+            decl_indices.append(pos)
+            pos = next_token(tokens, pos)
+        if len(decl_indices) != len(decl_pattern) or not is_ident(tokens[decl_indices[4]]):
+            result.append(tokens[index])
+            index += 1
+            continue
+
+        name = tokens[decl_indices[4]]
+        close = find_closing(tokens, decl_indices[-1])
+        values = [tok for tok in tokens[decl_indices[-1] + 1 : close]
+                  if not is_space(tok) and tok != ","]
+        values.extend(["0"] * (-len(values) % 4))
+        vectors = ["ivec4({0})".format(", ".join(values[k : k + 4]))
+                   for k in range(0, len(values), 4)]
+        result.extend(tokenize("const ivec4[] {0} = ivec4[] (\n{1}\n);\n"
+                               .format(name, ",\n".join(vectors))))
+        # Placeholder, the accessor must not be rewritten itself
+        result.append(name + "_at")
+        accessors[name + "_at"] = tokenize(
+            "int {0}_at(in int i) {{\n    return {0}[i >> 2][i & 0x03];\n}}".format(name))
+        index = next_token(tokens, close) + 1
+
+    for name_at in accessors:
+        result = rewrite_array_reads(result, name_at[: -len("_at")])
+    packed = []
+    for token in result:
+        packed.extend(accessors.pop(token, [token]))
+    return packed
+
+def rewrite_array_reads(tokens, name):
+    """
+    Replace name[expr] by name_at(expr) and name.length() by (name.length() << 2)
+    """
+    result = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        pos = next_token(tokens, index)
+        if token == name and pos < len(tokens) and tokens[pos] == "[":
+            close = find_closing(tokens, pos)
+            result.extend([name + "_at", "("])
+            result.extend(rewrite_array_reads(tokens[pos + 1 : close], name))
+            result.append(")")
+            index = close + 1
+        elif (token == name and tokens[pos : pos + 4] == [".", "length", "(", ")"]):
+            result.extend(["(", name, ".", "length", "(", ")", " ", "<<", " ", "2", ")"])
+            index = pos + 4
+        else:
+            result.append(token)
+            index += 1
+    return result
+
+def get_declared_names(tokens):
+    """
+    Identifiers declared in the source: names following a type
+    (with optional array brackets) and #define macro names
+    """
+    tokens = [tok for tok in tokens if not is_space(tok)]
+    declared = set()
+    for index, token in enumerate(tokens):
+        if token in TYPES:
+            pos = index + 1
+            if pos < len(tokens) and tokens[pos] == "[":
+                pos = find_closing(tokens, pos) + 1
+            if pos < len(tokens) and is_ident(tokens[pos]) and tokens[pos] not in RESERVED:
+                declared.add(tokens[pos])
+        elif token == "define" and index > 0 and tokens[index - 1] == "#":
+            declared.add(tokens[index + 1])
+    return declared - KEEP
+
+def get_short_names(reserved):
+    """
+    Generate identifiers ordered by length, skipping reserved ones
+    """
+    first_chars = string.ascii_letters
+    other_chars = string.ascii_letters + string.digits + "_"
+    for length in itertools.count(1):
+        for chars in itertools.product(other_chars, repeat=length - 1):
+            for first in first_chars:
+                name = first + "".join(chars)
+                if name not in reserved:
+                    yield name
+
+def rename_identifiers(tokens):
+    """
+    Give all declared identifiers the shortest available names,
+    most frequently used identifiers first. Swizzles are not touched.
+    """
+    declared = get_declared_names(tokens)
+    counts = {}
+    for index, token in enumerate(tokens):
+        if token in declared and prev_token(tokens, index) != ".":
+            counts[token] = counts.get(token, 0) + 1
+    # Macros also replace swizzles and members, so names after . are never generated
+    reserved = RESERVED | KEEP | {tok for index, tok in enumerate(tokens) if is_ident(tok)
+                                  and (tok not in declared or prev_token(tokens, index) == ".")}
+    names = get_short_names(reserved)
+    mapping = {name: next(names)
+               for name in sorted(counts, key=lambda name: (-counts[name], name))}
+    return [mapping[tok] if tok in mapping and prev_token(tokens, index) != "." else tok
+            for index, tok in enumerate(tokens)]
+
+def shorten_literals(tokens):
+    """
+    Replace int and float literals by their shortest spelling
+    """
+    result = []
+    for index, token in enumerate(tokens):
+        if is_int_literal(token):
+            token = get_shortest_int(token, prev_token(tokens, index))
+        elif token[0].isdigit() or (token[0] == "." and len(token) > 1):
+            token = get_shortest_float(token)
+        result.append(token)
+    return result
+
+def join_minified(tokens):
+    """
+    Join tokens dropping whitespace and comments, keeping spaces only
+    where tokens would merge and line breaks only around preprocessor lines
+    """
+    result = []
+    prev = ""
+    in_preprocessor = False
+    for token in tokens:
+        if is_space(token):
+            if in_preprocessor and "\n" in token:
+                result.append("\n")
+                in_preprocessor = False
+                prev = ""
+            continue
+        if token == "#":
+            if result and result[-1] != "\n":
+                result.append("\n")
+            in_preprocessor = True
+            prev = ""
+        if prev and TOKEN_RE.match(prev + token).group() != prev:
+            result.append(" ")
+        result.append(token)
+        prev = token
+    return "".join(result).strip() + "\n"
+
+def optimize(source, minify=True, pack_vec4=False):
+    """
+    Apply the selected optimizations to GLSL source
+    """
+    tokens = tokenize(source)
+    if pack_vec4:
+        tokens = pack_int_arrays(tokens)
+    if not minify:
+        return "".join(tokens)
+    tokens = shorten_literals(tokens)
+    tokens = rename_identifiers(tokens)
+    return join_minified(tokens)
+
+class TestGLSLMin(unittest.TestCase):
+    """
+    Test class for GLSL optimizer
+    """
+    def test_literals(self):
+        """
+        Shortest literal spelling
+        """
+        self.assertEqual(get_shortest_int("0x00000003", "("), "3")
+        self.assertEqual(get_shortest_int("4278190080", ","), "-16777216")
+        self.assertEqual(get_shortest_int("0xff000000", "-"), "0xff000000")
+        self.assertEqual(get_shortest_int("1000000", ","), "0xf4240")
+        self.assertEqual(get_shortest_float("255.0"), "255.")
+        self.assertEqual(get_shortest_float("0.50"), ".5")
+        self.assertEqual(get_shortest_float("0."), "0.")
+
+    def test_minify(self):
+        """
+        Identifiers, whitespace and swizzles
+        """
+        source = """
+#define PI 3.14
+// comment
+const int value_count = 0x02;
+float get_value(in vec2 pos) {
+    return pos.x * float(value_count) - -PI;
+}
+void mainImage(out vec4 fragColor, in vec2 fragCoord) {
+    fragColor = vec4(get_value(fragCoord));
+}
+"""
+        self.assertEqual(optimize(source),
+                         "#define a 3.14\n"
+                         "const int f=2;float d(in vec2 e){return e.x*float(f)- -a;}"
+                         "void mainImage(out vec4 b,in vec2 c){b=vec4(d(c));}\n")
+
+    def test_pack_vec4(self):
+        """
+        Packed int arrays and rewritten reads
+        """
+        source = ("const int[] data = int[] (1, 2, 3, 4, 5);\n"
+                  "int f(in int i) { return data[data[i]] + data.length(); }\n")
+        self.assertEqual(optimize(source, minify=False, pack_vec4=True),
+                         "const ivec4[] data = ivec4[] (\n"
+                         "ivec4(1, 2, 3, 4),\n"
+                         "ivec4(5, 0, 0, 0)\n"
+                         ");\n"
+                         "int data_at(in int i) {\n"
+                         "    return data[i >> 2][i & 0x03];\n"
+                         "}\n"
+                         "int f(in int i) { return data_at(data_at(i)) + "
+                         "(data.length() << 2); }\n")
+
+if __name__ == '__main__':
+    unittest.main()
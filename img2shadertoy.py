@@ -6,16 +6,24 @@ Convert image to a Shadertoy script
 """
 
 import argparse
+import collections
+import contextlib
+import functools
+import io
 import logging
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
 
 import bmpfile
 import rle
 import bits
 import dct
+import glslmin
 
-logging.basicConfig(format='-- %(message)s')
+logging.basicConfig(format='%(name)s -- %(message)s')
 LOGGER = logging.getLogger('img2shadertoy')
-LOGGER.setLevel(logging.DEBUG)
+LOGGER.setLevel(logging.WARNING)
 
 
 def output_header(bmp_data):
@@ -37,9 +45,11 @@ def output_palette(bmp_data):
               + ("," if i != bmp_data.palette_size-1 else ""))
     print(");")
 
+REVERSE_TYPES = {1: "bits", 2: "pairs", 4: "nibbles", 8: "endianness"}
+
 def reverse_bitmap_order(bmp_data, reverse_type):
     """
-    Reverse reverse_type ("bits"/"nibbles"/"endianness")so we save a
+    Reverse reverse_type ("bits"/"pairs"/"nibbles"/"endianness")so we save a
     subtraction in Shadertoy code to get the right pixel
     """
     for i in range(bmp_data.image_height):
@@ -48,6 +58,8 @@ def reverse_bitmap_order(bmp_data, reverse_type):
             bitmap_long = bmp_data.row_data[i][k * 4 : (k + 1)* 4]
             if reverse_type == "bits":
                 bitmap_long = bits.get_reverse_bits(bitmap_long)
+            elif reverse_type == "pairs":
+                bitmap_long = bits.get_reverse_pairs(bitmap_long)
             elif reverse_type == "nibbles":
                 bitmap_long = bits.get_reverse_nibbles(bitmap_long)
             elif reverse_type == "endianness":
@@ -57,6 +69,14 @@ def reverse_bitmap_order(bmp_data, reverse_type):
             new_row.append(bitmap_long)
         bmp_data.row_data[i] = bytes().join(new_row)
 
+def get_bitmap_ints(bmp_data):
+    """
+    Bitmap as flat list of 32 bit ints in the order they are output
+    """
+    return [int.from_bytes(bmp_data.row_data[i][k * 4 : (k + 1)* 4], byteorder='big')
+            for i in range(bmp_data.image_height)
+            for k in range(bmp_data.row_size // 4)]
+
 def output_bitmap(bmp_data):
     """
     Shadertoy output: bitmap
@@ -71,6 +91,81 @@ def output_bitmap(bmp_data):
         print(", ".join(hexvals)+ ("," if i != bmp_data.image_height - 1 else ""))
     print(");")
 
+def output_bitmap_decoder(bits_per_pixel, bitmap_fetch="bitmap[long_index]"):
+    """
+    Shadertoy output: getPaletteIndexXY for uncompressed bitmap,
+    bitmap_fetch is the expression that reads the long at long_index
+    """
+    decoders = {
+        1: """
+int getPaletteIndexXY(in ivec2 fetch_pos) {
+    int palette_index = 0;
+    if(fetch_pos.x >= 0 && fetch_pos.y >= 0
+        && fetch_pos.x < int(bitmap_size.x)&& fetch_pos.y < int(bitmap_size.y)) {
+        int line_index = fetch_pos.y * longs_per_line;
+
+        int long_index = line_index + (fetch_pos.x >> 5);
+        int bitmap_long = %s;
+
+        int bit_index = fetch_pos.x & 0x1f;
+        palette_index = (bitmap_long >> bit_index)& 1;
+    }
+    return palette_index;
+}
+""",
+        2: """
+int getPaletteIndexXY(in ivec2 fetch_pos) {
+    int palette_index = 0;
+    if(fetch_pos.x >= 0 && fetch_pos.y >= 0
+        && fetch_pos.x < int(bitmap_size.x)&& fetch_pos.y < int(bitmap_size.y)) {
+        int line_index = fetch_pos.y * longs_per_line;
+
+        int long_index = line_index + (fetch_pos.x >> 4);
+        int bitmap_long = %s;
+
+        int pair_index = fetch_pos.x & 0x0f;
+        palette_index = (bitmap_long >> (pair_index << 1))& 0x3;
+    }
+    return palette_index;
+}
+""",
+        4: """
+int getPaletteIndexXY(in ivec2 fetch_pos) {
+    int palette_index = 0;
+    if(fetch_pos.x >= 0 && fetch_pos.y >= 0
+        && fetch_pos.x < int(bitmap_size.x)&& fetch_pos.y < int(bitmap_size.y)) {
+        int line_index = fetch_pos.y * longs_per_line;
+
+        int long_index = line_index + (fetch_pos.x >> 3);
+        int bitmap_long = %s;
+
+        int nibble_index = fetch_pos.x & 0x07;
+        palette_index = (bitmap_long >> (nibble_index << 2))& 0xf;
+    }
+    return palette_index;
+}
+""",
+        8: """
+int getPaletteIndexXY(in ivec2 fetch_pos)
+{
+    int palette_index = 0;
+    if(fetch_pos.x >= 0 && fetch_pos.y >= 0
+        && fetch_pos.x < int(bitmap_size.x) && fetch_pos.y < int(bitmap_size.y))
+    {
+        int line_index = fetch_pos.y * longs_per_line;
+
+        int long_index = line_index + (fetch_pos.x >> 2);
+        int bitmap_long = %s;
+
+        int byte_index = fetch_pos.x & 0x03;
+        palette_index = (bitmap_long >> (byte_index << 3)) & 0xff;
+    }
+    return palette_index;
+}
+""",
+        }
+    print(decoders[bits_per_pixel] % bitmap_fetch)
+
 def output_footer():
     """
     Shadertoy output: bottom of script
@@ -101,16 +196,21 @@ void mainImage(out vec4 fragColor, in vec2 fragCoord) {
 }
 """)
 
+def get_packed_ints(encoded):
+    """
+    Pack byte array into 32 bit ints, first byte in least significant byte.
+    The tail is padded with zero bytes, which the decoder never reaches.
+    """
+    padded = encoded + bytes(-len(encoded) % 4)
+    return [int.from_bytes(padded[k * 4 : (k + 1)* 4], byteorder='little')
+            for k in range(len(padded)// 4)]
+
 def output_rle(encoded):
     """
     Shadertoy output: RLE output
     """
     print("const int[] rle = int[] (")
-    hexvals = []
-    for k in range(len(encoded)// 4):
-        long_val = encoded[k * 4 : (k + 1)* 4]
-        long_val = bits.get_reverse_endian(long_val)
-        hexvals.append("0x" + long_val.hex())
+    hexvals = ["0x{0:08x}".format(long_val) for long_val in get_packed_ints(encoded)]
     print(",\n".join(hexvals))
     print(");")
 
@@ -192,6 +292,46 @@ def sequences_to_bytes(sequence, value_op=None):
                 seq_len -= cur_len
     return b''.join(result)
 
+def get_rle_encoded(bmp_data, value_op=None):
+    """
+    RLE encode the whole bitmap as one byte stream, see sequences_to_bytes()
+    """
+    bitmap = bytes().join(bmp_data.row_data)
+    seq = rle.get_sequences(rle.get_repeat_counts(bitmap), 3)
+    return sequences_to_bytes(seq, value_op)
+
+def get_compact_bmp(bmp_data):
+    """
+    Remove unused palette entries and repack the pixels with the
+    smallest bits per pixel (1, 2, 4 or 8) that addresses the rest
+    """
+    pixels = bytes().join(bits.unpack_pixels(row, bmp_data.bits_per_pixel,
+                                             bmp_data.image_width)
+                          for row in bmp_data.row_data)
+    histogram = collections.Counter(pixels)
+    used = sorted(histogram)
+    bits_per_pixel = next(bpp for bpp in (1, 2, 4, 8) if len(used) <= 1 << bpp)
+    LOGGER.info("%d of %d palette entries used, storing %d bits per pixel",
+                len(used), bmp_data.palette_size, bits_per_pixel)
+
+    table = bytearray(256)
+    for new_index, old_index in enumerate(used):
+        table[old_index] = new_index
+    pixels = pixels.translate(table)
+
+    row_size = int(int((bits_per_pixel * bmp_data.image_width + 31) / 32) * 4)
+    row_padding = bytes(row_size - (bits_per_pixel * bmp_data.image_width + 7) // 8)
+    row_data = [bits.pack_pixels(pixels[i * bmp_data.image_width
+                                        : (i + 1) * bmp_data.image_width],
+                                 bits_per_pixel) + row_padding
+                for i in range(bmp_data.image_height)]
+
+    return bmp_data._replace(bits_per_pixel=bits_per_pixel,
+                             palette_size=len(used),
+                             palette=[bmp_data.palette[i] for i in used],
+                             row_size=row_size,
+                             row_data=row_data)
+
 def process_one_bit(bmp_data, rle_enabled):
     """
     Process 1bpp image
@@ -200,9 +340,7 @@ def process_one_bit(bmp_data, rle_enabled):
     output_palette(bmp_data)
 
     if rle_enabled:
-        bitmap = bytes().join(bmp_data.row_data)
-        seq = rle.get_sequences(rle.get_repeat_counts(bitmap), 3)
-        encoded = sequences_to_bytes(seq, bits.get_reverse_bits)
+        encoded = get_rle_encoded(bmp_data, bits.get_reverse_bits)
 
         output_rle(encoded)
 
@@ -224,26 +362,178 @@ int getPaletteIndexXY(in ivec2 fetch_pos) {
     else:
         reverse_bitmap_order(bmp_data, "bits")
         output_bitmap(bmp_data)
+        output_bitmap_decoder(1)
+
+    output_footer()
+
+def process_two_bit(bmp_data, rle_enabled):
+    """
+    Process 2bpp image
+    """
+    output_header(bmp_data)
+    output_palette(bmp_data)
+
+    if rle_enabled:
+        encoded = get_rle_encoded(bmp_data, bits.get_reverse_pairs)
+
+        output_rle(encoded)
+
         print("""
 int getPaletteIndexXY(in ivec2 fetch_pos) {
     int palette_index = 0;
     if(fetch_pos.x >= 0 && fetch_pos.y >= 0
         && fetch_pos.x < int(bitmap_size.x)&& fetch_pos.y < int(bitmap_size.y)) {
-        int line_index = fetch_pos.y * longs_per_line;
+        int uncompr_byte_index = fetch_pos.y * (int(bitmap_size.x)>> 2)
+            + (fetch_pos.x >> 2);
 
-        int long_index = line_index + (fetch_pos.x >> 5);
-        int bitmap_long = bitmap[long_index];
+        int uncompr_byte = get_uncompr_byte(uncompr_byte_index);
 
-        int bit_index = fetch_pos.x & 0x1f;
-        palette_index = (bitmap_long >> bit_index)& 1;
+        int pair_index = fetch_pos.x & 0x03;
+        palette_index = (uncompr_byte >> (pair_index << 1))& 0x3;
     }
     return palette_index;
 }
 """)
+    else:
+        reverse_bitmap_order(bmp_data, "pairs")
+        output_bitmap(bmp_data)
+
+        output_bitmap_decoder(2)
 
     output_footer()
 
-def process_four_bit(bmp_data, rle_enabled):
+RLE_MODES = ("auto", "bytes", "planes")
+BIT_PLANES = 4
+
+def get_bit_planes(bmp_data):
+    """
+    Split 4bpp image into four 1bpp images, plane k holding bit k of
+    every palette index. Only the pixel data of the planes is meaningful.
+    """
+    pixels = bytes().join(bits.unpack_pixels(row, bmp_data.bits_per_pixel,
+                                             bmp_data.image_width)
+                          for row in bmp_data.row_data)
+    row_size = bmp_data.image_width // 8
+    planes = []
+    for plane in range(BIT_PLANES):
+        table = bytes((byte_val >> plane) & 1 for byte_val in range(256))
+        packed = bits.pack_pixels(pixels.translate(table), 1)
+        planes.append(bmp_data._replace(bits_per_pixel=1,
+                                        row_size=row_size,
+                                        row_data=[packed[i * row_size : (i + 1) * row_size]
+                                                  for i in range(bmp_data.image_height)]))
+    return planes
+
+def get_plane_rle_encoded(plane):
+    """
+    RLE encode one bit plane like a 1bpp image
+    """
+    return get_rle_encoded(plane, bits.get_reverse_bits)
+
+def get_four_bit_rle(bmp_data, rle_mode="auto", jobs=None):
+    """
+    RLE encode 4bpp image as nibble bytes, as four bit planes or, in
+    auto mode, both ways keeping the smaller result.
+    Returns the chosen mode and the encoded stream or list of plane streams.
+    """
+    if rle_mode not in RLE_MODES:
+        raise RuntimeError("Unknown RLE mode %s" % rle_mode)
+
+    encoded = None
+    if rle_mode != "planes":
+        encoded = get_rle_encoded(bmp_data, bits.get_reverse_nibbles)
+        LOGGER.info("Nibble bytes: %d RLE encoded bytes", len(encoded))
+        if rle_mode == "bytes":
+            return "bytes", encoded
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        encoded_planes = list(executor.map(get_plane_rle_encoded, get_bit_planes(bmp_data)))
+    plane_bytes = bmp_data.image_width * bmp_data.image_height // 8
+    for plane, encoded_plane in enumerate(encoded_planes):
+        LOGGER.info("Bit plane %d: %d RLE encoded bytes, ratio %.2f",
+                    plane, len(encoded_plane), plane_bytes / len(encoded_plane))
+
+    # plane_start costs one int per plane plus the end offset
+    planes_size = (sum(len(encoded_plane) for encoded_plane in encoded_planes)
+                   + 4 * (BIT_PLANES + 1))
+    if rle_mode == "planes" or planes_size < len(encoded):
+        return "planes", encoded_planes
+    return "bytes", encoded
+
+def output_bit_plane_rle(encoded_planes):
+    """
+    Shadertoy output: all bit plane RLE streams in one array,
+    plane k spanning bytes plane_start[k] up to plane_start[k + 1]
+    """
+    plane_start = [0]
+    for encoded_plane in encoded_planes:
+        plane_start.append(plane_start[-1] + len(encoded_plane))
+
+    print("const int[] rle = int[] (")
+    hexvals = ["0x{0:08x}".format(long_val)
+               for long_val in get_packed_ints(bytes().join(encoded_planes))]
+    print(",\n".join(hexvals))
+    print(");")
+    print("const int[] plane_start = int[] (")
+    print(", ".join(map(str, plane_start)))
+    print(");")
+
+    print("""
+int get_rle_byte(in int byte_index) {
+    int long_val = rle[byte_index >> 2];
+    return (long_val >> ((byte_index & 0x03)<< 3))& 0xff;
+}
+
+int get_plane_byte(in int plane, in int byte_index) {
+    int rle_index = plane_start[plane];
+    int rle_end = plane_start[plane + 1];
+    int cur_byte_index = 0;
+    while(rle_index < rle_end) {
+        int cur_rle_byte = get_rle_byte(rle_index);
+        bool is_sequence = int(cur_rle_byte & 0x80)== 0;
+        int count = (cur_rle_byte & 0x7f)+ 1;
+
+        if(byte_index >= cur_byte_index && byte_index < cur_byte_index + count) {
+            if(is_sequence) {
+                return get_rle_byte(rle_index + 1 + (byte_index - cur_byte_index));
+            }
+            else{
+                return get_rle_byte(rle_index + 1);
+            }
+        }
+        else {
+            if(is_sequence) {
+                rle_index += count + 1;
+                cur_byte_index += count;
+            }
+            else {
+                rle_index += 2;
+                cur_byte_index += count;
+            }
+        }
+    }
+
+    return 0;
+}
+
+int getPaletteIndexXY(in ivec2 fetch_pos) {
+    int palette_index = 0;
+    if(fetch_pos.x >= 0 && fetch_pos.y >= 0
+        && fetch_pos.x < int(bitmap_size.x)&& fetch_pos.y < int(bitmap_size.y)) {
+        int uncompr_byte_index = fetch_pos.y * (int(bitmap_size.x)>> 3)
+            + (fetch_pos.x >> 3);
+
+        int bit_index = fetch_pos.x & 0x07;
+        for(int plane = 0; plane < 4; ++plane) {
+            int plane_byte = get_plane_byte(plane, uncompr_byte_index);
+            palette_index |= ((plane_byte >> bit_index)& 1)<< plane;
+        }
+    }
+    return palette_index;
+}
+""")
+
+def process_four_bit(bmp_data, rle_enabled, rle_mode="auto", jobs=None):
     """
     Process 4bpp image
     """
@@ -251,10 +541,10 @@ def process_four_bit(bmp_data, rle_enabled):
     output_palette(bmp_data)
 
     if rle_enabled:
-        bitmap = bytes().join(bmp_data.row_data)
-        seq = rle.get_sequences(rle.get_repeat_counts(bitmap), 3)
-        encoded = sequences_to_bytes(seq, bits.get_reverse_nibbles)
-
+        rle_mode, encoded = get_four_bit_rle(bmp_data, rle_mode, jobs)
+    if rle_enabled and rle_mode == "planes":
+        output_bit_plane_rle(encoded)
+    elif rle_enabled:
         output_rle(encoded)
 
         print("""
@@ -277,25 +567,13 @@ int getPaletteIndexXY(in ivec2 fetch_pos) {
         reverse_bitmap_order(bmp_data, "nibbles")
         output_bitmap(bmp_data)
 
-        print("""
-int getPaletteIndexXY(in ivec2 fetch_pos) {
-    int palette_index = 0;
-    if(fetch_pos.x >= 0 && fetch_pos.y >= 0
-        && fetch_pos.x < int(bitmap_size.x)&& fetch_pos.y < int(bitmap_size.y)) {
-        int line_index = fetch_pos.y * longs_per_line;
-
-        int long_index = line_index + (fetch_pos.x >> 3);
-        int bitmap_long = bitmap[long_index];
-
-        int nibble_index = fetch_pos.x & 0x07;
-        palette_index = (bitmap_long >> (nibble_index << 2))& 0xf;
-    }
-    return palette_index;
-}
-""")
+        output_bitmap_decoder(4)
 
     output_footer()
 
+DCT_PIXELS = 8  # Each DCT block encodes DCT_PIXELS x DCT_PIXELS
+DCT_WIDTH = 4   # Each DCT block contains DCT_WIDTH x DCT_WIDTH values
+
 # https://en.wikipedia.org/wiki/JPEG#Quantization
 QUANT_MTX = [
     [16, 11, 10, 16,],
@@ -304,48 +582,139 @@ QUANT_MTX = [
     [14, 17, 22, 29,],
     ]
 
-def get_quantized_dct_block(dct_width, compressed_dct_block):
-    """
-    Apply quantization matrix.
-    Divides original values by the quantization factor, rounds and converts to int.
-    Results in list of lists.
-    """
-    quantized_block = []
-    for y_index in range(dct_width):
-        quantized_row = []
-        for x_index in range(dct_width):
-            unquantized = compressed_dct_block[y_index][x_index]
-            quant_factor = QUANT_MTX[y_index][x_index]
-            quantized = int(round(unquantized / quant_factor))
-            quantized_row.append(quantized)
-        quantized_block.append(quantized_row)
-    return quantized_block
-
-def get_quantized_ints_block(dct_width, quantized_block):
-    """
-    Store quantized block as integers.
-    The 4 float values of each row are stored as 1 byte each in an int.
-    First row value is stored in least significant byte.
-    Results in a list of 4 ints.
-    """
-    ints_block = []
-    for y_index in range(dct_width):
-        current_int = 0
-        for x_index in range(dct_width):
-            quantized = quantized_block[y_index][x_index]
-            contrib = (quantized << (x_index * 8)) & (0xff << (x_index * 8))
-            current_int |= contrib
-        # print(current_int.to_bytes(4, byteorder='big'))
-        ints_block.append(current_int)
-    return ints_block
-
-def process_eight_bit(bmp_data, use_dct):
+# DCT stream symbols: values have the MSB cleared and are stored as 7 bit signed,
+# symbols with MSB set are runs of (symbol & 0x7f) zeros, a run of 0 ends the block.
+# Runs are shorter than DCT_WIDTH * DCT_WIDTH, so 0xff is free to escape values
+# outside of 7 bit signed, followed by the value as full signed byte.
+DCT_EOB = 0x80
+DCT_ZERO_RUN = 0x80
+DCT_ESCAPE = 0xff
+# Blocks sharing one 32 bit start offset. Offsets inside a group are stored in one
+# byte, so the first DCT_GROUP_BLOCKS - 1 blocks of a group must fit in 255 bytes:
+# 17 bytes per block (16 values, one escaped) is the limit. get_dct_encoded() checks
+# this, revisit when changing QUANT_MTX, DCT_WIDTH or the escape format.
+DCT_GROUP_BLOCKS = 16
+
+def get_zigzag_order(dct_width):
+    """
+    JPEG zigzag scan order of a dct_width x dct_width block as list of
+    (y_index, x_index), starting at the DC value.
+    """
+    positions = [(y_index, x_index)
+                 for y_index in range(dct_width) for x_index in range(dct_width)]
+    return sorted(positions, key=lambda pos: (pos[0] + pos[1],
+                                              pos[0] if (pos[0] + pos[1]) % 2 else pos[1]))
+
+def get_zigzag_ints(dct_width):
+    """
+    Zigzag order as flat block positions packed in nibbles,
+    8 positions per 32 bit int, first position in the lowest nibble
+    """
+    if dct_width > 4:
+        raise RuntimeError("Zigzag positions only fit in nibbles up to DCT width 4")
+    positions = [y_index * dct_width + x_index
+                 for y_index, x_index in get_zigzag_order(dct_width)]
+    return [sum(pos << (i * 4) for i, pos in enumerate(positions[k : k + 8]))
+            for k in range(0, len(positions), 8)]
+
+def get_quantized_bytes_block(dct_width, quantized_block):
+    """
+    Store quantized block as bytes in zigzag order.
+    Values are clamped to 8 bit signed, values outside of 7 bit signed are
+    escaped, zeros are run-length coded and trailing zeros are replaced by
+    the end of block marker.
+    """
+    values = [max(-128, min(127, quantized_block[y_index][x_index]))
+              for y_index, x_index in get_zigzag_order(dct_width)]
+    while values and values[-1] == 0:
+        values.pop()
+
+    result = []
+    zero_run = 0
+    for val in values:
+        if val == 0:
+            zero_run += 1
+            continue
+        if zero_run:
+            result.append(DCT_ZERO_RUN | zero_run)
+            zero_run = 0
+        if -64 <= val <= 63:
+            result.append(val & 0x7f)
+        else:
+            result.extend((DCT_ESCAPE, val & 0xff))
+    if len(values) < dct_width * dct_width:
+        result.append(DCT_EOB)
+    return bytes(result)
+
+def get_dct_blocks(bmp_data, dct_pixels, dct_width, backend="float"):
+    """
+    Convert 8bpp image to grayscale and DCT compress it in blocks of
+    dct_pixels x dct_pixels, keeping dct_width x dct_width quantized values.
+    Results in list of block rows, each a list of blocks as returned by
+    dct.get_quantized_2d_dct() using backend.
+    """
+    dct_cols = bmp_data.image_width // dct_pixels
+    dct_rows = bmp_data.image_height // dct_pixels
+    quant_mtx = [row[: dct_width] for row in QUANT_MTX[: dct_width]]
+
+    dct_blocks = []
+    for y_index in range(dct_rows):
+        dct_blocks_row = []
+        row_bytes = bmp_data.row_data[y_index * dct_pixels
+                                      : (y_index + 1) * dct_pixels]
+        for x_index in range(dct_cols):
+            dct_block_bytes = []
+            for i in range(dct_pixels):
+                dct_block_bytes.append(row_bytes[i][x_index * dct_pixels
+                                                    : (x_index + 1)* dct_pixels])
+
+            if backend == "float":
+                shifted_colors = []
+                for block_bytes in dct_block_bytes:
+                    color_vals = [(sum(bmp_data.palette[i])/ 3.0)for i in block_bytes]
+                    shifted_colors.append([(i - 128)for i in color_vals])
+                quantized_block = dct.get_quantized_2d_dct(shifted_colors, quant_mtx, backend)
+            else:
+                # Integer samples at 3 times the gray value, exact for any palette
+                shifted_sums = [[sum(bmp_data.palette[i]) - 3 * 128 for i in block_bytes]
+                                for block_bytes in dct_block_bytes]
+                quantized_block = dct.get_quantized_2d_dct(shifted_sums, quant_mtx, backend, 3)
+
+            dct_blocks_row.append(quantized_block)
+        dct_blocks.append(dct_blocks_row)
+    return dct_blocks
+
+def get_dct_encoded(dct_blocks, dct_width):
+    """
+    Concatenate all quantized blocks into one byte stream.
+    Returns the stream, the byte offset of every group of DCT_GROUP_BLOCKS
+    blocks and the offset of each block relative to the start of its group.
+    """
+    stream = []
+    group_starts = []
+    block_offsets = []
+    stream_len = 0
+    for dct_blocks_row in dct_blocks:
+        for quantized_block in dct_blocks_row:
+            if len(block_offsets) % DCT_GROUP_BLOCKS == 0:
+                group_starts.append(stream_len)
+            block_offset = stream_len - group_starts[-1]
+            if block_offset > 0xff:
+                raise RuntimeError("DCT block offset %d inside group does not fit in a byte, "
+                                   "reduce DCT_GROUP_BLOCKS" % block_offset)
+            block_offsets.append(block_offset)
+            block_bytes = get_quantized_bytes_block(dct_width, quantized_block)
+            stream.append(block_bytes)
+            stream_len += len(block_bytes)
+    return b''.join(stream), group_starts, bytes(block_offsets)
+
+def process_eight_bit(bmp_data, use_dct, dct_backend="float"):
     """
     Process 8bpp image
     """
     if use_dct:
-        dct_pixels = 8  # Each DCT block encodes dct_pixels x dct_pixels
-        dct_width = 4   # Each DCT block contains dct_width values
+        dct_pixels = DCT_PIXELS
+        dct_width = DCT_WIDTH
 
         if bmp_data.image_height % dct_pixels != 0:
             raise RuntimeError("Image height multiple of %d expected" % dct_pixels)
@@ -361,42 +730,24 @@ def process_eight_bit(bmp_data, use_dct):
         print("const int dct_width = {0};".format(dct_width))
         print("const int dct_cols = {0};".format(dct_cols))
         print("const int dct_rows = {0};".format(dct_rows))
+        print("const int dct_group_blocks = {0};".format(DCT_GROUP_BLOCKS))
 
-        dct_compressed_data = []
-        for y_index in range(dct_rows):
-            dct_compressed_row = []
-            row_bytes = bmp_data.row_data[y_index * dct_pixels
-                                          : (y_index + 1) * dct_pixels]
-            for x_index in range(dct_cols):
-                dct_block_bytes = []
-                for i in range(dct_pixels):
-                    dct_block_bytes.append(row_bytes[i][x_index * dct_pixels
-                                                        : (x_index + 1)* dct_pixels])
-
-                shifted_colors = []
-                for block_bytes in dct_block_bytes:
-                    color_vals = [(sum(bmp_data.palette[i])/ 3.0)for i in block_bytes]
-                    shifted_colors.append([(i - 128)for i in color_vals])
-
-                dct_block = dct.get_2d_dct(shifted_colors)
-
-                compressed_dct_block = []
-                for i in range(dct_width):
-                    compressed_dct_block.append(dct_block[i][: dct_width])
-
-                dct_compressed_row.append(compressed_dct_block)
-            dct_compressed_data.append(dct_compressed_row)
+        dct_stream, group_starts, block_offsets = get_dct_encoded(
+            get_dct_blocks(bmp_data, dct_pixels, dct_width, dct_backend), dct_width)
+        LOGGER.info("DCT stream %d bytes for %d blocks",
+                    len(dct_stream), len(block_offsets))
 
         print("\nconst int[] dct = int[] (")
-        for y_index in range(dct_rows):
-            for x_index in range(dct_cols):
-                dct_block = dct_compressed_data[y_index][x_index]
-                quantized_block = get_quantized_dct_block(dct_width, dct_block)
-                ints_block = get_quantized_ints_block(dct_width, quantized_block)
-                print(", ".join(map(str, ints_block))
-                      + ("" if (y_index == (dct_rows - 1) and (x_index == dct_cols - 1))
-                         else ","))
-            print()
+        print(",\n".join("0x{0:08x}".format(val) for val in get_packed_ints(dct_stream)))
+        print(");")
+        print("const int[] dct_group_start = int[] (")
+        print(", ".join(map(str, group_starts)))
+        print(");")
+        print("const int[] dct_block_offset = int[] (")
+        print(",\n".join("0x{0:08x}".format(val) for val in get_packed_ints(block_offsets)))
+        print(");")
+        print("const int[] zigzag = int[] (")
+        print(", ".join("0x{0:08x}".format(val) for val in get_zigzag_ints(dct_width)))
         print(");")
 
         print("""
@@ -407,16 +758,50 @@ const int[] quant_mtx = int[] (
 0x1d16110e
 );
 
-float get_dct_val(in int start, in int x, in int y) {
-    if(x < dct_width && y < dct_width) {
-        int int_block = dct[start + y];
-        int quant_val = (int_block >> (x << 3)) & 0xff;
-        if(quant_val > 127)
-            quant_val = -256 + quant_val;
+int get_dct_byte(in int byte_index) {
+    int long_val = dct[byte_index >> 2];
+    return (long_val >> ((byte_index & 0x03)<< 3))& 0xff;
+}
+
+void get_dct_block(in int dct_row, in int dct_col, out float vals[dct_width * dct_width]) {
+    for(int k = 0; k < dct_width * dct_width; ++k) {
+        vals[k] = 0.;
+    }
+
+    int block_index = dct_row * dct_cols + dct_col;
+    int block_offset = (dct_block_offset[block_index >> 2] >> ((block_index & 0x03) << 3)) & 0xff;
+    int byte_index = dct_group_start[block_index / dct_group_blocks] + block_offset;
+
+    int k = 0;
+    for(int n = 0; k < dct_width * dct_width; ++n) {
+        int symbol = get_dct_byte(byte_index + n);
+        if(symbol == 0x80)
+            break;
+        int quant_val = symbol;
+        if(symbol == 0xff) {
+            ++n;
+            quant_val = get_dct_byte(byte_index + n);
+            if(quant_val > 127)
+                quant_val = -256 + quant_val;
+        }
+        else if((symbol & 0x80) != 0) {
+            k += symbol & 0x7f;
+            continue;
+        }
+        else if(quant_val > 63)
+            quant_val = -128 + quant_val;
+        int pos = (zigzag[k >> 3] >> ((k & 0x07) << 2)) & 0x0f;
+        int x = pos % dct_width;
+        int y = pos / dct_width;
         float quant_factor = float((quant_mtx[y] >> (x << 3)) & 0xff);
-        float unquant_val = float(quant_val) * quant_factor;
-        return unquant_val;
+        vals[pos] = float(quant_val) * quant_factor;
+        ++k;
     }
+}
+
+float get_dct_val(in float vals[dct_width * dct_width], in int x, in int y) {
+    if(x < dct_width && y < dct_width)
+        return vals[y * dct_width + x];
     else
         return 0.;
 }
@@ -429,13 +814,13 @@ float cos_term(in int inner, in int outer) {
     return cos(PI * float(inner) * (2.0 * float(outer) + 1.0) / (2.0 * float(dct_pixels)));
 }
 
-float get_idct(in int start, in int i, in int j) {
+float get_idct(in float vals[dct_width * dct_width], in int i, in int j) {
     float NN = float(dct_pixels);
     float r = 0.;
 
     for(int x = 0; x < dct_pixels; ++x) {
         for(int y = 0; y < dct_pixels; ++y) {
-            r += c_factor(x) * c_factor(y) * get_dct_val(start, x, y) * cos_term(x, i) * cos_term(y, j);
+            r += c_factor(x) * c_factor(y) * get_dct_val(vals, x, y) * cos_term(x, i) * cos_term(y, j);
         }
     }
 
@@ -451,13 +836,13 @@ vec4 getBitmapColor(in vec2 uv) {
         int dct_row = fetch_pos.y / dct_pixels;
         int dct_col = fetch_pos.x / dct_pixels;
 
-        int dct_values_per_row = dct_width * dct_cols;
-        int dct_block_index = dct_row * dct_values_per_row + dct_col * dct_width;
+        float vals[dct_width * dct_width];
+        get_dct_block(dct_row, dct_col, vals);
 
         int pixel_x = fetch_pos.x % dct_pixels;
         int pixel_y = fetch_pos.y % dct_pixels;
 
-        float idct = get_idct(dct_block_index, pixel_x, pixel_y);
+        float idct = get_idct(vals, pixel_x, pixel_y);
         col = vec4((idct + 128.)/ 255.);
     }
     return col;
@@ -475,54 +860,360 @@ void mainImage(out vec4 fragColor, in vec2 fragCoord) {
         reverse_bitmap_order(bmp_data, "endianness")
         output_bitmap(bmp_data)
 
-        print("""
-int getPaletteIndexXY(in ivec2 fetch_pos)
-{
-    int palette_index = 0;
-    if(fetch_pos.x >= 0 && fetch_pos.y >= 0
-        && fetch_pos.x < int(bitmap_size.x) && fetch_pos.y < int(bitmap_size.y))
-    {
-        int line_index = fetch_pos.y * longs_per_line;
+        output_bitmap_decoder(8)
 
-        int long_index = line_index + (fetch_pos.x >> 2);
-        int bitmap_long = bitmap[long_index];
+        output_footer()
 
-        int byte_index = fetch_pos.x & 0x03;
-        palette_index = (bitmap_long >> (byte_index << 3)) & 0xff;
+def get_shared_palette_frames(frames):
+    """
+    Merge the colors used by all frames into one palette and remap the
+    pixels of every frame to it. Unused palette entries are dropped.
+    Returns list of remapped frames.
+    """
+    bits_per_pixel = frames[0].bits_per_pixel
+    palette = []
+    index_maps = []
+    for frame in frames:
+        used = set().union(*(bits.unpack_pixels(row, bits_per_pixel, frame.image_width)
+                             for row in frame.row_data))
+        index_map = {}
+        for i in sorted(used):
+            color = frame.palette[i]
+            if color not in palette:
+                palette.append(color)
+            index_map[i] = palette.index(color)
+        index_maps.append(index_map)
+
+    if len(palette) > (1 << bits_per_pixel):
+        raise RuntimeError("Frames use %d different colors, at most %d possible with %d bpp"
+                           % (len(palette), 1 << bits_per_pixel, bits_per_pixel))
+
+    result = []
+    for frame, index_map in zip(frames, index_maps):
+        row_data = frame.row_data
+        if any(i != val for i, val in index_map.items()):
+            table = bits.get_remap_table(index_map, bits_per_pixel)
+            row_data = [row.translate(table) for row in row_data]
+        result.append(frame._replace(palette=palette,
+                                     palette_size=len(palette),
+                                     row_data=row_data))
+    return result
+
+def encode_frame(frame, keyframe=None):
+    """
+    Reverse bitmap of frame for output and find the longs that differ from keyframe.
+    Returns reversed frame and lists of changed long indices and their values.
+    """
+    frame = frame._replace(row_data=list(frame.row_data))
+    changed = []
+    if keyframe is not None:
+        frame_ints = get_bitmap_ints(frame)
+        keyframe_ints = get_bitmap_ints(keyframe)
+        changed = [i for i, (val, key_val) in enumerate(zip(frame_ints, keyframe_ints))
+                   if val != key_val]
+
+    reverse_bitmap_order(frame, REVERSE_TYPES[frame.bits_per_pixel])
+    frame_ints = get_bitmap_ints(frame)
+    return frame, changed, [frame_ints[i] for i in changed]
+
+AnimationTables = collections.namedtuple("AnimationTables",
+                             ["frames",
+                              "key_rows",
+                              "delta_start",
+                              "delta_idx",
+                              "delta_val",])
+
+def get_animation_tables(frames, keyframe_interval, map_func=map):
+    """
+    Remap frames to a shared palette and split them into the reversed rows
+    of every keyframe and the per-frame delta tables read by getBitmapLong().
+    Frames are encoded with map_func, e.g. the map of a process pool.
+    """
+    frames = get_shared_palette_frames(frames)
+    keyframes = [None if i % keyframe_interval == 0
+                 else frames[i - i % keyframe_interval]
+                 for i in range(len(frames))]
+    encoded = list(map_func(encode_frame, frames, keyframes))
+
+    key_count = len(range(0, len(frames), keyframe_interval))
+    key_rows = []
+    for i in range(0, len(frames), keyframe_interval):
+        key_rows.extend(encoded[i][0].row_data)
+
+    delta_start = [0]
+    delta_idx = []
+    delta_val = []
+    for _frame, changed, values in encoded:
+        delta_idx.extend(changed)
+        delta_val.extend(values)
+        delta_start.append(len(delta_idx))
+    LOGGER.info("Stored %d changed longs in %d delta frames",
+                len(delta_idx), len(frames) - key_count)
+
+    return AnimationTables(frames, key_rows, delta_start, delta_idx, delta_val)
+
+def process_animation(filenames, keyframe_interval, frame_rate, jobs=None,
+                      load=bmpfile.load_bmp):
+    """
+    Process list of same sized images as animation frames with a shared palette.
+    Every keyframe_interval-th frame is stored in full, the frames in between
+    only store the longs that differ from their keyframe. Frames are read with load.
+    """
+    if keyframe_interval < 1:
+        raise RuntimeError("Keyframe interval must be at least 1")
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        frames = list(executor.map(load, filenames))
+
+        first = frames[0]
+        for frame in frames:
+            if (frame.image_width, frame.image_height, frame.bits_per_pixel) != (
+                    first.image_width, first.image_height, first.bits_per_pixel):
+                raise RuntimeError("All frames must have the same size and bits per pixel")
+        if first.bits_per_pixel not in REVERSE_TYPES:
+            raise RuntimeError("Current bits per pixel not supported")
+        if first.image_width % 32 != 0:
+            raise RuntimeError("Image width multiple of 32 expected")
+
+        tables = get_animation_tables(frames, keyframe_interval, executor.map)
+
+    output_header(first)
+    output_palette(tables.frames[0])
+
+    longs_per_frame = first.row_size // 4 * first.image_height
+    print("const int longs_per_frame = {0};".format(longs_per_frame))
+    print("const int frame_count = {0};".format(len(frames)))
+    print("const int keyframe_interval = {0};".format(keyframe_interval))
+    print("const float frame_rate = {0};".format(float(frame_rate)))
+
+    output_bitmap(first._replace(image_height=len(tables.key_rows), row_data=tables.key_rows))
+
+    # GLSL does not allow empty arrays, the dummy entry is never inside a frame range
+    print("const int[] delta_start = int[] (")
+    print(", ".join(map(str, tables.delta_start)))
+    print(");")
+    print("const int[] delta_idx = int[] (")
+    print(",\n".join(map(str, tables.delta_idx or [0])))
+    print(");")
+    print("const int[] delta_val = int[] (")
+    print(",\n".join("0x{0:08x}".format(val) for val in (tables.delta_val or [0])))
+    print(");")
+
+    print("""
+int getBitmapLong(in int long_index) {
+    int frame = int(iTime * frame_rate) % frame_count;
+    int lo = delta_start[frame];
+    int hi = delta_start[frame + 1];
+    while(lo < hi) {
+        int mid = (lo + hi) >> 1;
+        int changed_index = delta_idx[mid];
+        if(changed_index == long_index) {
+            return delta_val[mid];
+        }
+        if(changed_index < long_index) {
+            lo = mid + 1;
+        }
+        else {
+            hi = mid;
+        }
     }
-    return palette_index;
+    return bitmap[(frame / keyframe_interval) * longs_per_frame + long_index];
 }
 """)
 
-        output_footer()
+    output_bitmap_decoder(first.bits_per_pixel, "getBitmapLong(long_index)")
+    output_footer()
 
-def main():
+SCALES = {"1": 1, "1/2": 2, "1/4": 4}
+
+def parse_crop(text):
     """
-    Run the script
+    Parse crop rectangle argument x,y,w,h
     """
-    parser = argparse.ArgumentParser()
-    parser.add_argument("filename", help="path to bmp file")
-    parser.add_argument("--rle", help="enable RLE encoding", action="store_true")
-    parser.add_argument("--dct", help="enable DCT encoding (8 bit only, converts to grayscale)",
-                        action="store_true")
-    # parser.add_argument("--bw", help="convert to black & white (avoids storing palette)",
-    #                     action="store_true")
-    args = parser.parse_args()
+    try:
+        crop = tuple(int(val) for val in text.split(","))
+    except ValueError:
+        crop = ()
+    if len(crop) != 4:
+        raise argparse.ArgumentTypeError("expected x,y,w,h, got %r" % text)
+    return crop
+
+def load_frame(filename, crop=None, scale=1, resample="nearest"):
+    """
+    Load whole image, or only the cropped and downscaled region when requested
+    """
+    if crop is None and scale == 1:
+        return bmpfile.load_bmp(filename)
+    return bmpfile.load_bmp_region(filename, crop, scale, resample)
 
-    bmp_data = bmpfile.load_bmp(args.filename)
+def convert(args):
+    """
+    Print shader for the parsed command line arguments
+    """
+    scale = SCALES[args.scale]
+    if len(args.filename) > 1:
+        if args.rle or args.dct:
+            raise RuntimeError("Compression currently not supported for animations")
+        process_animation(args.filename, args.keyframe_interval, args.frame_rate, args.jobs,
+                          functools.partial(load_frame, crop=args.crop, scale=scale,
+                                            resample=args.resample))
+        return
+
+    bmp_data = load_frame(args.filename[0], args.crop, scale, args.resample)
     if bmp_data.image_width % 32 != 0:
         raise RuntimeError("Image width multiple of 32 expected")
 
+    if not (args.dct or args.no_compact):
+        bmp_data = get_compact_bmp(bmp_data)
+
     if bmp_data.bits_per_pixel == 1:
         process_one_bit(bmp_data, args.rle)
+    elif bmp_data.bits_per_pixel == 2:
+        process_two_bit(bmp_data, args.rle)
     elif bmp_data.bits_per_pixel == 4:
-        process_four_bit(bmp_data, args.rle)
+        process_four_bit(bmp_data, args.rle, args.rle_mode, args.jobs)
     elif bmp_data.bits_per_pixel == 8:
         if args.rle:
             raise RuntimeError("RLE currently not supported for this format")
-        process_eight_bit(bmp_data, args.dct)
+        process_eight_bit(bmp_data, args.dct, args.dct_backend)
     else:
         raise RuntimeError("Current bits per pixel not supported")
 
+def main():
+    """
+    Run the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", nargs="+",
+                        help="path to bmp file, several files are animation frames")
+    parser.add_argument("--rle", help="enable RLE encoding", action="store_true")
+    parser.add_argument("--rle-mode", help="4 bit RLE: encode nibble bytes, four bit planes "
+                        "or whichever is smaller", choices=RLE_MODES, default="auto")
+    parser.add_argument("--dct", help="enable DCT encoding (8 bit only, converts to grayscale)",
+                        action="store_true")
+    # parser.add_argument("--bw", help="convert to black & white (avoids storing palette)",
+    #                     action="store_true")
+    parser.add_argument("--dct-backend", help="DCT implementation: float reference or "
+                        "fast integer islow", choices=dct.BACKENDS, default="float")
+    parser.add_argument("--no-compact", help="keep unused palette entries and bits per pixel",
+                        action="store_true")
+    parser.add_argument("--crop", help="convert only the region x,y,w,h, y from the top",
+                        type=parse_crop)
+    parser.add_argument("--scale", help="downscale the (cropped) image",
+                        choices=sorted(SCALES), default="1")
+    parser.add_argument("--resample", help="downscale filter",
+                        choices=bmpfile.RESAMPLE_FILTERS, default="nearest")
+    parser.add_argument("--keyframe-interval", help="animation: store every n-th frame in full",
+                        type=int, default=8)
+    parser.add_argument("--frame-rate", help="animation: frames per second",
+                        type=float, default=10.0)
+    parser.add_argument("--jobs", help="number of worker processes for animation frames "
+                        "and bit planes", type=int)
+    parser.add_argument("--minify", help="shorten identifiers, literals and whitespace",
+                        action="store_true")
+    parser.add_argument("--pack-vec4", help="store data arrays as ivec4 arrays",
+                        action="store_true")
+    parser.add_argument("--verbose", help="log BMP header and encoder diagnostics",
+                        action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        bmpfile.LOGGER.setLevel(logging.INFO)
+        LOGGER.setLevel(logging.INFO)
+
+    if args.minify or args.pack_vec4:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            convert(args)
+        print(glslmin.optimize(output.getvalue(), args.minify, args.pack_vec4), end="")
+    else:
+        convert(args)
+
+class TestAnimation(unittest.TestCase):
+    """
+    Test class for animation encoding
+    """
+    @staticmethod
+    def decode_frame(tables, frame_index, keyframe_interval):
+        """
+        Colors of one frame read like getBitmapLong() and output_bitmap_decoder() do
+        """
+        first = tables.frames[0]
+        bits_per_pixel = first.bits_per_pixel
+        longs_per_line = first.row_size // 4
+        longs_per_frame = longs_per_line * first.image_height
+        key_ints = get_bitmap_ints(first._replace(image_height=len(tables.key_rows),
+                                                  row_data=tables.key_rows))
+        changed = dict(zip(tables.delta_idx[tables.delta_start[frame_index]
+                                            : tables.delta_start[frame_index + 1]],
+                           tables.delta_val[tables.delta_start[frame_index]
+                                            : tables.delta_start[frame_index + 1]]))
+        pixels_per_long = 32 // bits_per_pixel
+        colors = []
+        for y in range(first.image_height):
+            for x in range(first.image_width):
+                long_index = y * longs_per_line + x // pixels_per_long
+                long_val = changed.get(long_index,
+                                       key_ints[(frame_index // keyframe_interval)
+                                                * longs_per_frame + long_index])
+                palette_index = ((long_val >> ((x % pixels_per_long) * bits_per_pixel))
+                                 & ((1 << bits_per_pixel) - 1))
+                colors.append(first.palette[palette_index])
+        return colors
+
+    @staticmethod
+    def get_colors(frame):
+        """
+        Colors of frame in the same order as decode_frame()
+        """
+        return [frame.palette[i] for row in frame.row_data
+                for i in bits.unpack_pixels(row, frame.bits_per_pixel, frame.image_width)]
+
+    def test_permuted_palettes(self):
+        """
+        Frames with permuted palettes and changed rows decode to their colors
+        """
+        for bits_per_pixel in (1, 4, 8):
+            source = bmpfile.load_bmp("test_32x32_%dbpp.bmp" % bits_per_pixel)
+            frames = []
+            for k in range(5):
+                count = len(source.palette)
+                perm = [(i + k) % count for i in range(count)]
+                if k % 2:
+                    perm.reverse()
+                palette = [None] * count
+                for old_index, new_index in enumerate(perm):
+                    palette[new_index] = source.palette[old_index]
+                table = bits.get_remap_table(dict(enumerate(perm)), bits_per_pixel)
+                row_data = [row.translate(table) for row in source.row_data]
+                if k >= 3:
+                    row_data = row_data[k :] + row_data[: k]
+                frames.append(source._replace(palette=palette, row_data=row_data))
+
+            tables = get_animation_tables(frames, 2)
+            self.assertEqual(len(tables.delta_start), len(frames) + 1)
+            self.assertEqual(tables.delta_start[1], tables.delta_start[2])
+            self.assertLess(tables.delta_start[3], tables.delta_start[4])
+            for frame_index, frame in enumerate(frames):
+                self.assertEqual(self.decode_frame(tables, frame_index, 2),
+                                 self.get_colors(frame))
+
+    def test_unused_palette_entries(self):
+        """
+        Full palettes that differ only in unused entries still fit
+        """
+        source = bmpfile.load_bmp("test_32x32_8bpp.bmp")
+        frames = []
+        for k in range(2):
+            palette = [(i, k, 255 - i) for i in range(256)]
+            row_data = [bytes((x + y + k) % 4 for x in range(32)) for y in range(32)]
+            frames.append(source._replace(palette_size=256, palette=palette,
+                                          row_data=row_data))
+        tables = get_animation_tables(frames, 8)
+        self.assertEqual(len(tables.frames[0].palette), 8)
+        for frame_index, frame in enumerate(frames):
+            self.assertEqual(self.decode_frame(tables, frame_index, 8),
+                             self.get_colors(frame))
+
 if __name__ == '__main__':
     main()
@@ -46,4 +46,6 @@ def get_sequences(sequence, min_seq_len=1):
             result.append(("R", count, val))
         else:
             build_seq.extend([val] * count)
+    if build_seq:
+        result.append(("S", build_seq))
     return result
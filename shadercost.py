@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Estimate the per-fragment cost of generated shaders by emulating
+the emitted GLSL decoders in Python over every pixel
+"""
+
+import argparse
+import logging
+import math
+import unittest
+
+from collections import namedtuple
+
+import bmpfile
+import bits
+import img2shadertoy
+
+logging.basicConfig(format='%(name)s -- %(message)s')
+LOGGER = logging.getLogger('shadercost')
+LOGGER.setLevel(logging.WARNING)
+
+
+FragmentCost = namedtuple("FragmentCost",
+                          ["loop_iterations",
+                           "array_reads",
+                           "alu_ops",])
+
+CostStats = namedtuple("CostStats",
+                       ["mean",
+                        "p99",
+                        "max",])
+
+# Operation counts of the fixed GLSL snippets, counted from the emitted source.
+# Every operator, comparison, type conversion and builtin call is one ALU op.
+BOUNDS_CHECK_OPS = 9        # 4 comparisons, 3 &&, 2 int()
+FOOTER_COST = FragmentCost(0, 1, 14)    # mainImage, getPaletteIndex, getColorFromPalette
+BITMAP_XY_OPS = {1: 6, 2: 7, 4: 7, 8: 7}      # getPaletteIndexXY without bounds check
+RLE_XY_OPS = {1: 8, 2: 9, 4: 9}
+RLE_BYTE_OPS = 5            # get_rle_byte
+RLE_ITERATION_OPS = 10      # while condition, is_sequence, count, range check
+RLE_SKIP_OPS = {True: 3, False: 2}      # advance past sequence / repeat
+RLE_HIT_OPS = {True: 3, False: 1}       # index of returned sequence / repeat byte
+PLANE_XY_OPS = 7            # byte index, bit index and final plane loop check
+PLANE_LOOP_OPS = 7          # plane loop, plane + 1, shift, mask and combine
+PLANE_START_READS = 2       # plane_start lookups in get_plane_byte
+DCT_OUTER_OPS = 18          # mainImage, getBitmapColor and block position math
+DCT_LOOP_OPS = 2            # for loop compare and increment
+DCT_SEEK_COST = FragmentCost(0, 2, 8)   # block offset lookup in get_dct_block
+DCT_SYMBOL_COST = FragmentCost(1, 1, 9) # decode loop iteration up to end of block check
+DCT_ESCAPE_CHECK_OPS = 1    # escape check of every symbol after end of block check
+DCT_ZERO_RUN_OPS = 4        # zero run check and skip
+DCT_VALUE_COST = FragmentCost(0, 2, 17) # run check, packed zigzag position, unquantization
+DCT_ESCAPE_COST = FragmentCost(0, 1, 8) # read of escaped full byte and its sign check
+DCT_NEGATIVE_OPS = 1        # sign extension of negative quantized value
+DCT_BODY_OPS = 30           # c_factor x2, range check, cos_term x2, accumulate
+DCT_C_FACTOR_ZERO_OPS = 2   # sqrt and division when c_factor index is 0
+DCT_LOCAL_OPS = 2           # local vals index when inside dct_width
+DCT_FINAL_OPS = 3           # float(dct_pixels) and final scaling
+
+
+def get_reference_indices(bmp_data):
+    """
+    Palette index of every pixel read directly from the unmodified BMP rows,
+    flat list in row-major order starting at the bottom row
+    """
+    result = []
+    for row in bmp_data.row_data[: bmp_data.image_height]:
+        result.extend(bits.unpack_pixels(row, bmp_data.bits_per_pixel, bmp_data.image_width))
+    return result
+
+def get_reference_grays(bmp_data):
+    """
+    Grayscale value of every pixel as computed by the DCT encoder
+    """
+    gray_palette = [sum(color) / 3.0 for color in bmp_data.palette]
+    return [gray_palette[i] for i in get_reference_indices(bmp_data)]
+
+def emulate_bitmap(bmp_data):
+    """
+    Emulate getPaletteIndexXY of the uncompressed modes.
+    Returns flat lists of palette indices and FragmentCost per pixel.
+    """
+    reverse_type = img2shadertoy.REVERSE_TYPES[bmp_data.bits_per_pixel]
+    reversed_data = bmp_data._replace(row_data=list(bmp_data.row_data))
+    img2shadertoy.reverse_bitmap_order(reversed_data, reverse_type)
+    bitmap = img2shadertoy.get_bitmap_ints(reversed_data)
+    longs_per_line = bmp_data.row_size // 4
+
+    bits_per_pixel = bmp_data.bits_per_pixel
+    pixels_per_long_shift = {1: 5, 2: 4, 4: 3, 8: 2}[bits_per_pixel]
+    pixel_mask = (1 << bits_per_pixel) - 1
+    pixels_per_long_mask = (1 << pixels_per_long_shift) - 1
+
+    cost = FragmentCost(FOOTER_COST.loop_iterations,
+                        FOOTER_COST.array_reads + 1,
+                        FOOTER_COST.alu_ops + BOUNDS_CHECK_OPS + BITMAP_XY_OPS[bits_per_pixel])
+
+    indices = []
+    for y in range(bmp_data.image_height):
+        line_index = y * longs_per_line
+        indices.extend((bitmap[line_index + (x >> pixels_per_long_shift)]
+                        >> ((x & pixels_per_long_mask) * bits_per_pixel)) & pixel_mask
+                       for x in range(bmp_data.image_width))
+    return indices, [cost] * len(indices)
+
+def walk_rle(get_rle_byte, rle_index, rle_end, total_bytes):
+    """
+    Walk an RLE stream once like the shader loop does for the last byte,
+    keeping the state at which every uncompressed byte is found.
+    Returns uncompressed bytes, their FragmentCost list and the cost of
+    running off the end of the stream.
+    """
+    uncompr_bytes = []
+    byte_costs = []
+    iterations = 0
+    skip_ops = 0
+    while rle_index < rle_end and len(uncompr_bytes) < total_bytes:
+        cur_rle_byte = get_rle_byte(rle_index)
+        is_sequence = (cur_rle_byte & 0x80) == 0
+        count = (cur_rle_byte & 0x7f) + 1
+        iterations += 1
+        hit_cost = FragmentCost(iterations,
+                                iterations + 1,
+                                (skip_ops + iterations * (RLE_ITERATION_OPS + RLE_BYTE_OPS)
+                                 + RLE_HIT_OPS[is_sequence] + RLE_BYTE_OPS))
+        for i in range(count):
+            uncompr_bytes.append(get_rle_byte(rle_index + 1 + (i if is_sequence else 0)))
+            byte_costs.append(hit_cost)
+        skip_ops += RLE_SKIP_OPS[is_sequence]
+        rle_index += (count + 1) if is_sequence else 2
+
+    end_cost = FragmentCost(iterations,
+                            iterations,
+                            skip_ops + iterations * (RLE_ITERATION_OPS + RLE_BYTE_OPS))
+    return uncompr_bytes, byte_costs, end_cost
+
+def get_rle_byte_reader(encoded):
+    """
+    Python version of the shader's get_rle_byte() over the packed stream
+    """
+    rle_ints = img2shadertoy.get_packed_ints(encoded)
+
+    def get_rle_byte(byte_index):
+        return (rle_ints[byte_index >> 2] >> ((byte_index & 0x03) << 3)) & 0xff
+    return get_rle_byte, len(rle_ints) << 2
+
+def emulate_rle(bmp_data, rle_mode="auto"):
+    """
+    Emulate getPaletteIndexXY and get_uncompr_byte of the RLE modes.
+    Returns flat lists of palette indices and FragmentCost per pixel.
+    """
+    bits_per_pixel = bmp_data.bits_per_pixel
+    if bits_per_pixel not in RLE_XY_OPS:
+        raise RuntimeError("RLE currently not supported for this format")
+    if bits_per_pixel == 4:
+        rle_mode, encoded = img2shadertoy.get_four_bit_rle(bmp_data, rle_mode)
+        if rle_mode == "planes":
+            return emulate_bit_plane_rle(bmp_data, encoded)
+    else:
+        value_op = {1: bits.get_reverse_bits,
+                    2: bits.get_reverse_pairs}[bits_per_pixel]
+        encoded = img2shadertoy.get_rle_encoded(bmp_data, value_op)
+    get_rle_byte, rle_len_bytes = get_rle_byte_reader(encoded)
+
+    total_bytes = (bmp_data.image_width * bmp_data.image_height * bits_per_pixel) >> 3
+    uncompr_bytes, byte_costs, end_cost = walk_rle(get_rle_byte, 0, rle_len_bytes, total_bytes)
+
+    xy_ops = FOOTER_COST.alu_ops + BOUNDS_CHECK_OPS + RLE_XY_OPS[bits_per_pixel]
+    byte_shift = {1: 3, 2: 2, 4: 1}[bits_per_pixel]
+    pixel_mask = (1 << bits_per_pixel) - 1
+    pixels_per_byte_mask = (1 << byte_shift) - 1
+    bytes_per_line = bmp_data.image_width >> byte_shift
+
+    indices = []
+    costs = []
+    for y in range(bmp_data.image_height):
+        for x in range(bmp_data.image_width):
+            byte_index = y * bytes_per_line + (x >> byte_shift)
+            if byte_index < len(uncompr_bytes):
+                uncompr_byte = uncompr_bytes[byte_index]
+                byte_cost = byte_costs[byte_index]
+            else:
+                # Loop ran off the end of the stream and returned 0
+                uncompr_byte = 0
+                byte_cost = end_cost
+            indices.append((uncompr_byte >> ((x & pixels_per_byte_mask) * bits_per_pixel))
+                           & pixel_mask)
+            costs.append(FragmentCost(byte_cost.loop_iterations,
+                                      FOOTER_COST.array_reads + byte_cost.array_reads,
+                                      xy_ops + byte_cost.alu_ops))
+    return indices, costs
+
+def emulate_bit_plane_rle(bmp_data, encoded_planes):
+    """
+    Emulate getPaletteIndexXY and get_plane_byte of the 4bpp bit plane RLE mode.
+    Returns flat lists of palette indices and FragmentCost per pixel.
+    """
+    get_rle_byte, _rle_len_bytes = get_rle_byte_reader(bytes().join(encoded_planes))
+    total_bytes = (bmp_data.image_width * bmp_data.image_height) >> 3
+    bytes_per_line = bmp_data.image_width >> 3
+
+    plane_start = 0
+    planes = []
+    for encoded_plane in encoded_planes:
+        planes.append(walk_rle(get_rle_byte, plane_start,
+                               plane_start + len(encoded_plane), total_bytes))
+        plane_start += len(encoded_plane)
+
+    xy_ops = FOOTER_COST.alu_ops + BOUNDS_CHECK_OPS + PLANE_XY_OPS
+    indices = []
+    costs = []
+    for y in range(bmp_data.image_height):
+        for x in range(bmp_data.image_width):
+            byte_index = y * bytes_per_line + (x >> 3)
+            palette_index = 0
+            cost = FragmentCost(0, FOOTER_COST.array_reads, xy_ops)
+            for plane, (uncompr_bytes, byte_costs, end_cost) in enumerate(planes):
+                if byte_index < len(uncompr_bytes):
+                    palette_index |= ((uncompr_bytes[byte_index] >> (x & 0x07)) & 1) << plane
+                    byte_cost = byte_costs[byte_index]
+                else:
+                    byte_cost = end_cost
+                cost = FragmentCost(cost.loop_iterations + 1 + byte_cost.loop_iterations,
+                                    cost.array_reads + PLANE_START_READS + byte_cost.array_reads,
+                                    cost.alu_ops + PLANE_LOOP_OPS + byte_cost.alu_ops)
+            indices.append(palette_index)
+            costs.append(cost)
+    return indices, costs
+
+def emulate_dct(bmp_data, dct_backend="float"):
+    """
+    Emulate getBitmapColor, get_dct_block and get_idct of the DCT mode.
+    Returns flat lists of grayscale values (0-255) and FragmentCost per pixel.
+    """
+    dct_pixels = img2shadertoy.DCT_PIXELS
+    dct_width = img2shadertoy.DCT_WIDTH
+    if bmp_data.image_height % dct_pixels != 0:
+        raise RuntimeError("Image height multiple of %d expected" % dct_pixels)
+    dct_stream, group_starts, block_offsets = img2shadertoy.get_dct_encoded(
+        img2shadertoy.get_dct_blocks(bmp_data, dct_pixels, dct_width, dct_backend),
+        dct_width)
+    dct_ints = img2shadertoy.get_packed_ints(dct_stream)
+    block_offset_ints = img2shadertoy.get_packed_ints(block_offsets)
+    zigzag_ints = img2shadertoy.get_zigzag_ints(dct_width)
+    dct_values = dct_width * dct_width
+    dct_cols = bmp_data.image_width // dct_pixels
+    dct_rows = bmp_data.image_height // dct_pixels
+
+    def get_dct_byte(byte_index):
+        return (dct_ints[byte_index >> 2] >> ((byte_index & 0x03) << 3)) & 0xff
+
+    c_factor = [1.0 / math.sqrt(2.0)] + [1.0] * (dct_pixels - 1)
+    cos_term = [[math.cos(math.pi * inner * (2.0 * outer + 1.0) / (2.0 * dct_pixels))
+                 for outer in range(dct_pixels)]
+                for inner in range(dct_pixels)]
+
+    # Every fragment runs the full dct_pixels x dct_pixels IDCT loop,
+    # only decoding the block stream differs between blocks.
+    idct_ops = (DCT_OUTER_OPS + DCT_FINAL_OPS
+                + dct_values * DCT_LOOP_OPS
+                + DCT_SEEK_COST.alu_ops
+                + dct_pixels * DCT_LOOP_OPS
+                + dct_pixels * dct_pixels * (DCT_LOOP_OPS + DCT_BODY_OPS)
+                + 2 * dct_pixels * DCT_C_FACTOR_ZERO_OPS
+                + dct_values * DCT_LOCAL_OPS)
+    idct_iterations = dct_values + dct_pixels + dct_pixels * dct_pixels
+
+    grays = [0.0] * (bmp_data.image_width * bmp_data.image_height)
+    costs = [None] * len(grays)
+    for block_row in range(dct_rows):
+        for block_col in range(dct_cols):
+            block_index = block_row * dct_cols + block_col
+            byte_index = (group_starts[block_index // img2shadertoy.DCT_GROUP_BLOCKS]
+                          + ((block_offset_ints[block_index >> 2]
+                              >> ((block_index & 0x03) << 3)) & 0xff))
+            cost = FragmentCost(idct_iterations, DCT_SEEK_COST.array_reads, idct_ops)
+
+            flat_values = [0] * dct_values
+            k = 0
+            n = 0
+            while k < dct_values:
+                cost = FragmentCost(*map(sum, zip(cost, DCT_SYMBOL_COST)))
+                symbol = get_dct_byte(byte_index + n)
+                n += 1
+                if symbol == img2shadertoy.DCT_EOB:
+                    break
+                cost = cost._replace(alu_ops=cost.alu_ops + DCT_ESCAPE_CHECK_OPS)
+                quant_val = symbol
+                if symbol == img2shadertoy.DCT_ESCAPE:
+                    cost = FragmentCost(*map(sum, zip(cost, DCT_ESCAPE_COST)))
+                    quant_val = get_dct_byte(byte_index + n)
+                    n += 1
+                    if quant_val > 127:
+                        quant_val = -256 + quant_val
+                        cost = cost._replace(alu_ops=cost.alu_ops + DCT_NEGATIVE_OPS)
+                elif symbol & img2shadertoy.DCT_ZERO_RUN:
+                    cost = cost._replace(alu_ops=cost.alu_ops + DCT_ZERO_RUN_OPS)
+                    k += symbol & 0x7f
+                    continue
+                elif quant_val > 63:
+                    quant_val = -128 + quant_val
+                    cost = cost._replace(alu_ops=cost.alu_ops + DCT_NEGATIVE_OPS)
+                cost = FragmentCost(*map(sum, zip(cost, DCT_VALUE_COST)))
+                pos = (zigzag_ints[k >> 3] >> ((k & 0x07) << 2)) & 0x0f
+                flat_values[pos] = (quant_val * img2shadertoy.QUANT_MTX[pos // dct_width]
+                                    [pos % dct_width])
+                k += 1
+            values = [flat_values[y * dct_width : (y + 1) * dct_width]
+                      for y in range(dct_width)]
+
+            for pixel_y in range(dct_pixels):
+                for pixel_x in range(dct_pixels):
+                    idct = 0.0
+                    for x in range(dct_width):
+                        for y in range(dct_width):
+                            idct += (c_factor[x] * c_factor[y] * values[y][x]
+                                     * cos_term[x][pixel_x] * cos_term[y][pixel_y])
+                    idct *= 2.0 / dct_pixels
+                    index = ((block_row * dct_pixels + pixel_y) * bmp_data.image_width
+                             + block_col * dct_pixels + pixel_x)
+                    grays[index] = idct + 128.0
+                    costs[index] = cost
+    return grays, costs
+
+def get_stats(values):
+    """
+    Mean, 99th percentile (nearest rank) and maximum of a list of numbers
+    """
+    if not values:
+        return CostStats(0, 0, 0)
+    sorted_values = sorted(values)
+    p99_rank = max(1, int(math.ceil(0.99 * len(sorted_values))))
+    return CostStats(sum(sorted_values) / len(sorted_values),
+                     sorted_values[p99_rank - 1],
+                     sorted_values[-1])
+
+def save_heatmap(filepath, image_width, image_height, values):
+    """
+    Save list of per-pixel values as 8bpp grayscale BMP, white is most expensive
+    """
+    max_value = max(values) if values else 0
+    scale = 255.0 / max_value if max_value else 0.0
+    row_size = int(int((8 * image_width + 31) / 32) * 4)
+    padding = bytes(row_size - image_width)
+    row_data = []
+    for y in range(image_height):
+        row = values[y * image_width : (y + 1) * image_width]
+        row_data.append(bytes(int(round(val * scale)) for val in row) + padding)
+    bmpfile.save_bmp(filepath, bmpfile.BMPData(image_width,
+                                               image_height,
+                                               8,
+                                               256,
+                                               [(i, i, i) for i in range(256)],
+                                               row_size,
+                                               row_data,))
+
+def estimate(bmp_data, rle_enabled=False, use_dct=False, compact=True, dct_backend="float",
+             rle_mode="auto"):
+    """
+    Emulate the shader that img2shadertoy would generate for bmp_data.
+    Returns decoded values, reference values and per-pixel FragmentCost lists.
+    Values are grayscale levels for DCT and palette colors otherwise.
+    """
+    if use_dct:
+        if bmp_data.bits_per_pixel != 8:
+            raise RuntimeError("DCT only supported for 8 bits per pixel")
+        decoded, costs = emulate_dct(bmp_data, dct_backend)
+        return decoded, get_reference_grays(bmp_data), costs
+
+    encoded_bmp = img2shadertoy.get_compact_bmp(bmp_data) if compact else bmp_data
+    if rle_enabled:
+        decoded, costs = emulate_rle(encoded_bmp, rle_mode)
+    else:
+        decoded, costs = emulate_bitmap(encoded_bmp)
+    return ([encoded_bmp.palette[i] for i in decoded],
+            [bmp_data.palette[i] for i in get_reference_indices(bmp_data)],
+            costs)
+
+def main():
+    """
+    Run the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="path to bmp file")
+    parser.add_argument("--rle", help="estimate RLE encoded shader", action="store_true")
+    parser.add_argument("--rle-mode", help="4 bit RLE mode to estimate",
+                        choices=img2shadertoy.RLE_MODES, default="auto")
+    parser.add_argument("--dct", help="estimate DCT encoded shader", action="store_true")
+    parser.add_argument("--dct-backend", help="DCT implementation to estimate",
+                        choices=img2shadertoy.dct.BACKENDS, default="float")
+    parser.add_argument("--no-compact", help="estimate without palette compaction",
+                        action="store_true")
+    parser.add_argument("--crop", help="estimate only the region x,y,w,h, y from the top",
+                        type=img2shadertoy.parse_crop)
+    parser.add_argument("--scale", help="downscale the (cropped) image",
+                        choices=sorted(img2shadertoy.SCALES), default="1")
+    parser.add_argument("--resample", help="downscale filter",
+                        choices=bmpfile.RESAMPLE_FILTERS, default="nearest")
+    parser.add_argument("--heatmap", help="save per-pixel ALU op counts as BMP to this path")
+    parser.add_argument("--tolerance", help="maximum mean absolute DCT error in gray levels",
+                        type=float, default=32.0)
+    parser.add_argument("--max-p99", help="fail if p99 ALU ops per fragment exceeds this",
+                        type=int)
+    parser.add_argument("--verbose", help="log BMP header and encoder diagnostics",
+                        action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        bmpfile.LOGGER.setLevel(logging.INFO)
+        img2shadertoy.LOGGER.setLevel(logging.INFO)
+        LOGGER.setLevel(logging.INFO)
+
+    bmp_data = img2shadertoy.load_frame(args.filename, args.crop,
+                                        img2shadertoy.SCALES[args.scale], args.resample)
+    if bmp_data.image_width % 32 != 0:
+        raise RuntimeError("Image width multiple of 32 expected")
+
+    decoded, reference, costs = estimate(bmp_data, args.rle, args.dct, not args.no_compact,
+                                         args.dct_backend, args.rle_mode)
+
+    for field in FragmentCost._fields:
+        stats = get_stats([getattr(cost, field) for cost in costs])
+        print("{0}: mean {1:.2f}, p99 {2}, max {3}".format(field, *stats))
+
+    if args.heatmap:
+        save_heatmap(args.heatmap, bmp_data.image_width, bmp_data.image_height,
+                     [cost.alu_ops for cost in costs])
+
+    if args.dct:
+        errors = [abs(dec - ref) for dec, ref in zip(decoded, reference)]
+        mean_error = sum(errors) / len(errors)
+        print("dct error: mean {0:.2f}, max {1:.2f}".format(mean_error, max(errors)))
+        if mean_error > args.tolerance:
+            raise RuntimeError("DCT error %.2f exceeds tolerance %.2f"
+                               % (mean_error, args.tolerance))
+    else:
+        mismatches = sum(1 for dec, ref in zip(decoded, reference) if dec != ref)
+        print("mismatched pixels: {0}".format(mismatches))
+        if mismatches:
+            raise RuntimeError("Decoded bitmap differs from source in %d pixels" % mismatches)
+
+    if args.max_p99 is not None:
+        p99 = get_stats([cost.alu_ops for cost in costs]).p99
+        if p99 > args.max_p99:
+            raise RuntimeError("p99 ALU ops %d exceeds limit %d" % (p99, args.max_p99))
+
+class TestShaderCost(unittest.TestCase):
+    """
+    Test class for decoder emulation
+    """
+    def test_lossless(self):
+        """
+        Uncompressed and RLE modes reproduce the test bitmaps
+        """
+        for bits_per_pixel in (1, 4, 8):
+            bmp_data = bmpfile.load_bmp("test_32x32_%dbpp.bmp" % bits_per_pixel)
+            for rle_enabled in ((False, True) if bits_per_pixel != 8 else (False,)):
+                for compact in (False, True):
+                    decoded, reference, costs = estimate(bmp_data, rle_enabled,
+                                                         compact=compact)
+                    self.assertEqual(decoded, reference)
+                    self.assertEqual(len(costs), 32 * 32)
+
+    def test_two_bit(self):
+        """
+        Palette compaction to 2bpp for both modes
+        """
+        bmp_data = bmpfile.load_bmp("test_32x32_1bpp.bmp")
+        pixels = bytes((x * y) % 3 for y in range(32) for x in range(32))
+        bmp_data = bmp_data._replace(
+            bits_per_pixel=8, palette_size=256, row_size=32,
+            palette=[(i, i, i) for i in range(256)],
+            row_data=[pixels[y * 32 : (y + 1) * 32] for y in range(32)])
+        self.assertEqual(img2shadertoy.get_compact_bmp(bmp_data).bits_per_pixel, 2)
+        for rle_enabled in (False, True):
+            decoded, reference, _costs = estimate(bmp_data, rle_enabled)
+            self.assertEqual(decoded, reference)
+
+    def test_bit_planes(self):
+        """
+        Bit plane RLE reproduces the bitmap and wins on gradients
+        """
+        bmp_data = bmpfile.load_bmp("test_32x32_4bpp.bmp")
+        pixels = bytes(min(15, (x + y) // 4) for y in range(32) for x in range(32))
+        gradient = bmp_data._replace(
+            row_data=[bits.pack_pixels(pixels[y * 32 : (y + 1) * 32], 4) for y in range(32)])
+        for source in (bmp_data, gradient):
+            decoded, reference, costs = estimate(source, True, compact=False, rle_mode="planes")
+            self.assertEqual(decoded, reference)
+            self.assertEqual(len(costs), 32 * 32)
+        self.assertEqual(img2shadertoy.get_four_bit_rle(gradient)[0], "planes")
+        self.assertEqual(img2shadertoy.get_four_bit_rle(bmp_data)[0], "bytes")
+
+    def test_dct(self):
+        """
+        DCT mode stays close to the grayscale source
+        """
+        bmp_data = bmpfile.load_bmp("test_32x32_8bpp.bmp")
+        decoded, reference, costs = estimate(bmp_data, use_dct=True)
+        errors = [abs(dec - ref) for dec, ref in zip(decoded, reference)]
+        self.assertLess(sum(errors) / len(errors), 32.0)
+
+        islow_decoded, _reference, _costs = estimate(bmp_data, use_dct=True, dct_backend="islow")
+        for dec, islow_dec in zip(decoded, islow_decoded):
+            self.assertLess(abs(dec - islow_dec), 16.0)
+        # 16 zeroing iterations, 16 symbols of a block without EOB, 8 + 64 IDCT iterations
+        self.assertEqual(get_stats([cost.loop_iterations for cost in costs]).max, 104)
+
+    def test_dct_edge(self):
+        """
+        Hard edge coefficients outside 7 bit signed are escaped, not clamped
+        """
+        bmp_data = bmpfile.load_bmp("test_32x32_8bpp.bmp")
+        row = bytes(0 if x % 8 < 4 else 255 for x in range(32))
+        bmp_data = bmp_data._replace(palette_size=256, palette=[(i, i, i) for i in range(256)],
+                                     row_data=[row] * 32)
+        dct_blocks = img2shadertoy.get_dct_blocks(bmp_data, 8, 4)
+        self.assertLess(dct_blocks[0][0][0][1], -64)
+        block_bytes = img2shadertoy.get_quantized_bytes_block(4, dct_blocks[0][0])
+        self.assertIn(img2shadertoy.DCT_ESCAPE, block_bytes)
+
+        # One escaped value per block fills a group up to the last one byte offset
+        escaped_block = [[100, 1, 1, 1]] + [[1] * 4] * 3
+        _stream, _group_starts, block_offsets = img2shadertoy.get_dct_encoded(
+            [[escaped_block] * 17], 4)
+        self.assertEqual(block_offsets[15], 255)
+        with self.assertRaises(RuntimeError):
+            img2shadertoy.get_dct_encoded([[[[100, -100, 1, 1]] + [[1] * 4] * 3] * 16], 4)
+
+        decoded, _reference, _costs = estimate(bmp_data, use_dct=True)
+        self.assertLess(decoded[0], 30.0)
+        self.assertGreater(decoded[7], 225.0)
+
+    def test_stats(self):
+        """
+        Statistics helper
+        """
+        self.assertEqual(get_stats(list(range(1, 101))), CostStats(50.5, 99, 100))
+
+if __name__ == '__main__':
+    main()